@@ -0,0 +1,9 @@
+"""
+Benchmarks for category and messages chain modules
+
+Every module is runnable from the repository root and prints JSON report:
+
+    python -m benchmarks.models
+    python -m benchmarks.storage
+"""
+import local_packages  # noqa: F401
@@ -0,0 +1,70 @@
+"""
+Parse time and memory of ChainModel read paths
+
+    python -m benchmarks.models --count 10000
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from messages_chain.chain_model import ChainModel, ChainRecord
+
+
+def _payload(index: int) -> dict:
+    if index % 3:
+        return ChainModel(
+            message_id=index,
+            content_type="photo",
+            data_id=f"file_{index}",
+            text=f"caption {index}",
+            source_chat_id=1,
+            source_message_ids=[index],
+        ).dict()
+    return ChainModel(
+        message_id=index,
+        is_media_group=True,
+        content_type=["photo"] * 4,
+        data_id=[f"file_{index}_{_}" for _ in range(4)],
+        text=f"album {index}",
+        source_chat_id=1,
+        source_message_ids=list(range(index, index + 4)),
+    ).dict()
+
+
+def _measure(name: str, build: Callable[[dict], object], payloads: List[dict]) -> Dict:
+    started = time.perf_counter()
+    for _ in payloads:
+        build(_)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    objects = [build(_) for _ in payloads]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+
+    return {
+        "name": name,
+        "count": len(payloads),
+        "parse_us_per_object": elapsed / len(payloads) * 1e6,
+        "bytes_per_object": (after - before) / len(payloads),
+    }
+
+
+def run(count: int) -> List[Dict]:
+    payloads = [_payload(_) for _ in range(count)]
+    return [
+        _measure("ChainModel.parse_obj", ChainModel.parse_obj, payloads),
+        _measure("ChainModel.trusted", ChainModel.trusted, payloads),
+        _measure("ChainRecord.from_dict", ChainRecord.from_dict, payloads),
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=10000)
+    args = parser.parse_args()
+    print(json.dumps(run(args.count), indent=2))
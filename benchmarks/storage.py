@@ -0,0 +1,262 @@
+"""
+Latency and throughput of category and chain storages, keyboard build and chain compile
+
+Runs against in-process stand-ins (mongomock-motor, fakeredis) by default,
+or against real servers with --mongo-uri / --redis-url:
+
+    pip install mongomock-motor fakeredis
+    python -m benchmarks.storage --depth 4 --fanout 8 --nodes 5000 --concurrency 16 -o report.json
+
+Backends whose packages are not installed are reported as skipped, so are
+cascade deletes on mongomock-motor, which has no sessions for the transaction.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import time
+from typing import Awaitable, Callable, Dict, List
+
+from category.buttons import CategoryButtons, CategoryCallBackData
+from category.model import CategoryModel
+from messages_chain.chain_model import ChainModel
+from messages_chain.plan import compile_chain
+
+
+def _report(name: str, samples: List[float], elapsed: float, concurrency: int) -> Dict:
+    samples = sorted(samples)
+
+    def percentile(q: float) -> float:
+        return samples[min(len(samples) - 1, int(q * len(samples)))] * 1e3
+
+    return {
+        "name": name,
+        "count": len(samples),
+        "concurrency": concurrency,
+        "mean_ms": statistics.fmean(samples) * 1e3,
+        "p50_ms": percentile(0.50),
+        "p90_ms": percentile(0.90),
+        "p99_ms": percentile(0.99),
+        "max_ms": samples[-1] * 1e3,
+        "ops_per_s": len(samples) / elapsed if elapsed else None,
+    }
+
+
+async def _timed(name: str, call: Callable[[int], Awaitable], count: int, concurrency: int) -> Dict:
+    """call(index) for index in range(count), by concurrency workers"""
+    samples: List[float] = []
+    indexes = iter(range(count))
+
+    async def worker() -> None:
+        for index in indexes:
+            started = time.perf_counter()
+            await call(index)
+            samples.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return _report(name, samples, time.perf_counter() - started, concurrency)
+
+
+def build_tree(depth: int, fanout: int, nodes: int) -> List[CategoryModel]:
+    """Breadth-first tree of at most nodes categories, fanout children per category"""
+    categories: List[CategoryModel] = []
+    level = [CategoryModel(id=f"c{_}", name=f"Category {_}") for _ in range(min(fanout, nodes))]
+    categories.extend(level)
+    for _ in range(depth - 1):
+        next_level = []
+        for parent in level:
+            for index in range(fanout):
+                if len(categories) + len(next_level) >= nodes:
+                    break
+                child = CategoryModel(
+                    id=f"{parent.id}.{index}",
+                    name=f"Category {parent.id}.{index}",
+                    parent_id=parent.id,
+                    ancestors=parent.ancestors + [parent.id],
+                )
+                parent.subcategories.append(child.id)
+                next_level.append(child)
+        categories.extend(next_level)
+        level = next_level
+    return categories
+
+
+async def _category_db(mongo_uri: str | None):
+    if mongo_uri:
+        from messages_chain.mongo_pool import get_client
+        return get_client(mongo_uri).get_database("benchmarks")
+    from mongomock_motor import AsyncMongoMockClient
+    return AsyncMongoMockClient().get_database("benchmarks")
+
+
+async def bench_categories(args, skipped: Dict[str, str]) -> List[Dict]:
+    from category.storage.mongo import MongoStorage
+
+    db = await _category_db(args.mongo_uri)
+    repo = MongoStorage(db)
+    await repo.init()
+    await repo.document.get_motor_collection().delete_many({})
+
+    tree = build_tree(args.depth, args.fanout, args.nodes)
+    started = time.perf_counter()
+    await repo.insert_categories(tree)
+    elapsed = time.perf_counter() - started
+    results = [{"name": "category.insert_categories", "count": len(tree), "elapsed_ms": elapsed * 1e3, "ops_per_s": len(tree) / elapsed}]
+
+    rand = random.Random(args.seed)
+    ids = [_.id for _ in tree]
+    parents = [_.id for _ in tree if _.subcategories] or ids
+    top = [_.id for _ in tree if _.parent_id == 'root']
+
+    results.append(await _timed(
+        "category.get_category", lambda _: repo.get_category(rand.choice(ids)), args.iterations, args.concurrency))
+    results.append(await _timed(
+        "category.get_subcategories", lambda _: repo.get_subcategories(rand.choice(parents)), args.iterations, args.concurrency))
+    results.append(await _timed(
+        "category.get_subcategories_page", lambda _: repo.get_subcategories_page(rand.choice(parents)), args.iterations, args.concurrency))
+    results.append(await _timed(
+        "category.get_branch_categories", lambda _: repo.get_branch_categories(rand.choice(top)), args.iterations, args.concurrency))
+
+    # every delete removes a different branch right under a main category
+    victims = [_.id for _ in tree if len(_.ancestors) == 1]
+    rand.shuffle(victims)
+    count = min(args.iterations, len(victims))
+    deleted = await _timed(
+        "category.delete_category_cascade", lambda index: repo.delete_category(victims[index]), count, args.concurrency)
+    # delete_category logs errors instead of raising, timings of failed deletes mean nothing
+    left, _ = await repo.get_categories(victims[:count])
+    if left:
+        skipped["category.delete_category_cascade"] = f"{len(left)} of {count} deletes failed, see log"
+    else:
+        results.append(deleted)
+    return results
+
+
+def bench_keyboard(args) -> List[Dict]:
+    buttons = CategoryButtons(CategoryCallBackData())
+    categories = [CategoryModel(id=f"k{_}", name=f"Category {_}") for _ in range(args.fanout)]
+    results = []
+    for name, reorder in (("keyboard.build", False), ("keyboard.build_reorder", True)):
+        samples = []
+        started = time.perf_counter()
+        for _ in range(args.iterations):
+            begin = time.perf_counter()
+            buttons._categories(categories, None, "root", isAdmin=True, isReorder=reorder, id=categories[0].id)
+            samples.append(time.perf_counter() - begin)
+        results.append(_report(name, samples, time.perf_counter() - started, 1))
+    return results
+
+
+def _chain(length: int) -> List[ChainModel]:
+    chain = []
+    for index in range(length):
+        if index % 3 == 2:
+            chain.append(ChainModel(
+                message_id=index, is_media_group=True, content_type=["photo"] * 3,
+                data_id=[f"file_{index}_{_}" for _ in range(3)], text=f"album {index}",
+                source_chat_id=1, source_message_ids=[index, index + 1, index + 2],
+            ))
+        else:
+            chain.append(ChainModel(
+                message_id=index, content_type="photo", data_id=f"file_{index}", text=f"caption {index}",
+                source_chat_id=1, source_message_ids=[index],
+            ))
+    return chain
+
+
+def bench_compile(args) -> List[Dict]:
+    chain = _chain(args.chain_length)
+    results = []
+    for name, replay in (("chain.compile", False), ("chain.compile_replay", True)):
+        samples = []
+        started = time.perf_counter()
+        for _ in range(args.iterations):
+            begin = time.perf_counter()
+            compile_chain(chain, replay=replay)
+            samples.append(time.perf_counter() - begin)
+        results.append(_report(name, samples, time.perf_counter() - started, 1))
+    return results
+
+
+async def _chain_storage(backend: str, args):
+    if backend == "memory":
+        from messages_chain.storage.memory import MemoryStorage
+        return MemoryStorage()
+    if backend == "redis":
+        from messages_chain.storage.redis import RedisStorage
+        if args.redis_url:
+            import aioredis
+            connection = aioredis.from_url(args.redis_url)
+        else:
+            from fakeredis import aioredis as fake_aioredis
+            connection = fake_aioredis.FakeRedis()
+        return RedisStorage(connection=connection, prefix="benchmarks", ttl=3600)
+    if backend == "mongo":
+        from messages_chain.storage.mongo import MongoStorage
+        return MongoStorage(db=await _category_db(args.mongo_uri), prefix="benchmarks", ttl=3600)
+    raise ValueError(f"{backend} is unsupported storage")
+
+
+async def bench_chain(backend: str, args) -> List[Dict]:
+    storage = await _chain_storage(backend, args)
+    await storage.init()
+    chain = _chain(args.chain_length)
+    sessions = max(1, args.iterations // args.chain_length)
+
+    async def append(index: int) -> None:
+        await storage.add_message(index % sessions, 1, chain[index // sessions % len(chain)])
+
+    results = [await _timed(f"chain.{backend}.add_message", append, sessions * args.chain_length, args.concurrency)]
+    results.append(await _timed(
+        f"chain.{backend}.get_all_chain", lambda index: storage.get_all_chain(index % sessions, 1),
+        args.iterations, args.concurrency))
+    for session in range(sessions):
+        await storage.delete_all(session, 1)
+    return results
+
+
+async def run(args) -> Dict:
+    results = []
+    skipped = {}
+    try:
+        results.extend(await bench_categories(args, skipped))
+    except ModuleNotFoundError as e:
+        skipped["category.mongo"] = str(e)
+    results.extend(bench_keyboard(args))
+    results.extend(bench_compile(args))
+    for backend in args.chain_backends.split(","):
+        try:
+            results.extend(await bench_chain(backend, args))
+        except ModuleNotFoundError as e:
+            skipped[f"chain.{backend}"] = str(e)
+    return {
+        "params": dict((key, value) for key, value in vars(args).items() if key != "output"),
+        "python": platform.python_version(),
+        "results": results,
+        "skipped": skipped,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=6)
+    parser.add_argument("--nodes", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--chain-length", type=int, default=10)
+    parser.add_argument("--chain-backends", default="memory,redis,mongo")
+    parser.add_argument("--mongo-uri", default=None, help="real server instead of mongomock-motor")
+    parser.add_argument("--redis-url", default=None, help="real server instead of fakeredis")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default=None, help="write report to file instead of stdout")
+    args = parser.parse_args()
+    report = json.dumps(asyncio.run(run(args)), indent=2)
+    if args.output:
+        with open(args.output, "w") as fp:
+            fp.write(report)
+    else:
+        print(report)
@@ -1,7 +1,8 @@
-from ast import List
+from typing import List, Tuple
 from aiogram.utils.callback_data import CallbackData
 from aiogram.types import InlineKeyboardButton,InlineKeyboardMarkup
 
+from .cache import LRUCache
 from .model import CategoryModel, CustomButtonsModel
 
 class CategoryCallBackData:
@@ -13,9 +14,44 @@ class CategoryCallBackData:
 
 
 class CategoryButtons:
+    """
+    cache_size - keep up to that many built markups, None disables the cache
+    ttl - seconds after which markup is built again, None to keep until invalidated
 
-    def __init__(self,callback:CategoryCallBackData) -> None:
+    Cached markups are keyed by category id, page, isAdmin and isReorder,
+    custom buttons and texts are expected to be the same for every call.
+    Call invalidate(category_id) after any write to that category,
+    Category does it for writes seen by CachedStorage, ttl bounds the rest
+    """
+
+    def __init__(self,callback:CategoryCallBackData, cache_size: int | None = None, ttl: float | None = 300) -> None:
         self.cb = callback
+        self._markups = LRUCache(cache_size, ttl) if cache_size else None
+
+    def invalidate(self, *category_ids: str) -> None:
+        if self._markups is not None:
+            category_ids = set(category_ids)
+            self._markups.pop_where(lambda key, _: key[1] in category_ids)
+
+    def clear(self) -> None:
+        if self._markups is not None:
+            self._markups.clear()
+
+    @staticmethod
+    def _markup_key(kind: str, category_id: str, *args) -> Tuple:
+        return (kind, category_id, *args)
+
+    def cached_markup(self,
+        current_id: str,
+        page: int = 1,
+        isAdmin: bool = False,
+        isReorder: bool = False,
+        id: str = "",
+        parent_id: str | None = None,
+    ) -> InlineKeyboardMarkup | None:
+        if self._markups is None:
+            return None
+        return self._markups.get(self._markup_key("categories", current_id, page, isAdmin, isReorder, id, parent_id))
 
 
     @staticmethod
@@ -38,9 +74,20 @@ class CategoryButtons:
         isAdmin: bool = False,
         isReorder: bool = False,
         id: str = "",
-        control_text: str = "Category Controls"
+        control_text: str = "Category Controls",
+        total: int | None = None,
+        page_size: int = 6,
+        parent_id: str | None = None,
+        back_text: str = "⬅️ Back",
     ) -> InlineKeyboardMarkup:
-        lenght = len(categories)
+        """
+        categories - only the requested page when total is passed,
+        otherwise all subcategories and page is cut here
+        parent_id - adds back button to the parent, main categories have no back button
+        """
+        if total is None:
+            total = len(categories)
+            categories = categories[(page - 1) * page_size:page * page_size]
         keyboard = InlineKeyboardMarkup(row_width=1)
 
         if custom_buttons and custom_buttons.category:
@@ -60,87 +107,75 @@ class CategoryButtons:
             keyboard.add(
                 InlineKeyboardButton(
                     control_text,
-                    callback_data=self.cb.control.new(type="menu"),
+                    callback_data=self.cb.control.new(type="menu", id=current_id),
                 )
             )
 
         buttons = [
             InlineKeyboardButton(
-                _.name, callback_data=CategoryCallBackData.category.new(id=_.id)
+                _.name, callback_data=self.cb.category.new(id=_.id)
             )
             for _ in categories
         ]
-        pages = 1
+        pages = max(1, -(-total // page_size))
         start = 0
-        stop = 4
-        position = [_ for _ in categories if _.id == id]
-        if not position:
-            position = 0
+        stop = len(categories) - 1
+        position = next((index for index, _ in enumerate(categories) if _.id == id), 0)
         reorder_buttons = [
             InlineKeyboardButton(
                 text=" " if page > 1 else "◀️",
-                callback_data=CategoryCallBackData.control.new(
+                callback_data=self.cb.control.new(
                     type="reorder", id=" " if page > 1 else "c_back"
                 ),
             ),
             InlineKeyboardButton(
                 text="🔼",
-                callback_data=CategoryCallBackData.control.new(
+                callback_data=self.cb.control.new(
                     type="reorder", id=" " if position > start else "c_up"
                 ),
             ),
-            InlineKeyboardButton(text=f"{page} / {pages}"),
+            InlineKeyboardButton(text=f"{page} / {pages}", callback_data=" "),
             InlineKeyboardButton(
                 text="🔽",
-                callback_data=CategoryCallBackData.control.new(
+                callback_data=self.cb.control.new(
                     type="reorder", id=" " if position < stop else "c_down"
                 ),
             ),
             InlineKeyboardButton(
                 text=" " if page < pages else "▶️",
-                callback_data=CategoryCallBackData.control.new(
+                callback_data=self.cb.control.new(
                     type="reorder", id=" " if page < pages else "c_next"
                 ),
             ),
         ]
 
-        if lenght > 6:
-            pages = lenght // 6
+        keyboard.add(*buttons)
+        if pages > 1 and not isReorder:
             navigation = [
                 InlineKeyboardButton(
-                    text=" " if page > 1 else "⤎",
-                    callback_data=CategoryCallBackData.control.new(
-                        type="page", id=" " if page > 1 else "back"
+                    text="⤎" if page > 1 else " ",
+                    callback_data=self.cb.control.new(
+                        type="page", id=f"{current_id}|{max(page - 1, 1)}"
                     ),
                 ),
-                InlineKeyboardButton(text=f"{page} / {pages}"),
+                InlineKeyboardButton(text=f"{page} / {pages}", callback_data=" "),
                 InlineKeyboardButton(
-                    text=" " if page < pages else "⤏",
-                    callback_data=CategoryCallBackData.control.new(
-                        type="page", id=" " if page < pages else "next"
+                    text="⤏" if page < pages else " ",
+                    callback_data=self.cb.control.new(
+                        type="page", id=f"{current_id}|{min(page + 1, pages)}"
                     ),
                 ),
             ]
-            start = (page - 1) * 4
-            stop = start + 4
-            keyboard.add(*buttons[start, stop])
-            if not isReorder:
-                keyboard.row(navigation)
-        else:
-            keyboard.add(*buttons)
+            keyboard.row(*navigation)
         if isReorder:
-            keyboard.row(reorder_buttons)
+            keyboard.row(*reorder_buttons)
+        if parent_id and parent_id != 'root':
+            keyboard.row(InlineKeyboardButton(back_text, callback_data=self.cb.category.new(id=parent_id)))
+        if self._markups is not None:
+            self._markups.set(self._markup_key("categories", current_id, page, isAdmin, isReorder, id, parent_id), keyboard)
         return keyboard
 
-    def control_menu(text: List[str] | None) -> InlineKeyboardMarkup:
-        if not text:
-            text = [
-                "Add Subcategory",
-                "Change Name",
-                "Change Description",
-                "Reorder Subcategories",
-                "Delete Category",
-            ]
+    def control_menu(self, text: List[str] | None = None, id: str = "") -> InlineKeyboardMarkup:
         """
             Param: text - text for buttons
 
@@ -151,15 +186,32 @@ class CategoryButtons:
             4 - delete category
 
         """
+        if not text:
+            text = [
+                "Add Subcategory",
+                "Change Name",
+                "Change Description",
+                "Reorder Subcategories",
+                "Delete Category",
+            ]
+        key = self._markup_key("control", id, tuple(text))
+        if self._markups is not None:
+            keyboard = self._markups.get(key)
+            if keyboard is not None:
+                return keyboard
+
         types = ["sub", "name", "description", "reorder", "delete"]
         keyboard = InlineKeyboardMarkup(row_width=1)
         buttons = [
             InlineKeyboardButton(
-                name, callback_data=CategoryCallBackData.control.new(type=type)
+                name, callback_data=self.cb.control.new(type=type, id=id)
             )
             for name, type in zip(text, types)
         ]
-        return keyboard.add(*buttons)
+        keyboard.add(*buttons)
+        if self._markups is not None:
+            self._markups.set(key, keyboard)
+        return keyboard
 
     def save_subcategories(
         *texts: str
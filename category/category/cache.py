@@ -0,0 +1,58 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterator, Tuple
+
+
+class LRUCache:
+    """
+    Bounded mapping with least recently used eviction
+
+    Args:
+        maxsize - how many entries to keep
+        ttl - seconds after which entry is stale, None for no expiration
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float | None = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        stored_at, value = item
+        if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def pop_where(self, predicate: Callable[[Hashable, Any], bool]) -> None:
+        for key in [key for key, (_, value) in self._data.items() if predicate(key, value)]:
+            del self._data[key]
+
+    def items(self) -> Iterator[Tuple[Hashable, Any]]:
+        return ((key, value) for key, (_, value) in list(self._data.items()))
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+_MISSING = object()
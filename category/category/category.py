@@ -1,15 +1,31 @@
-from typing import List
+import asyncio
+import logging
+import re
+from typing import List, Set, Tuple
 from aiogram import Dispatcher
 from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters.builtin import CommandStart
 from aiogram.dispatcher.filters.state import State, StatesGroup
-from aiogram.types import CallbackQuery, Message
+from aiogram.types import (
+    CallbackQuery,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQuery,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    Message,
+)
 
 
-from messages_chain import MessagesChain, MongoConnection
+from messages_chain import MessagesChain, compile_chain
+from messages_chain.metrics import Recorder, Traced
 
 from .buttons import CategoryButtons, CategoryCallBackData
+from .cache import LRUCache
 from .model import CategoryModel, CustomButtonsModel, MessageTextModel
-from .repo import CategoryRepo
+from .repo import CategoryRepo, MongoConnection
+from .search import CategoryTrie
+from .storage.cached import CachedStorage
 
 
 
@@ -22,7 +38,14 @@ class CategoryStates(StatesGroup):
     reoder = State()
 
 
+# payload of t.me/<bot>?start=... link which opens category
+DEEP_LINK_PREFIX = "cat_"
+
+
 class Category:
+    page_size = 6
+    search_limit = 20
+
     def __init__(
         self,
         storage: MongoConnection,
@@ -31,10 +54,31 @@ class Category:
         prefix: str = "base",
         admin_ids: List[str] = [],
         texts: MessageTextModel = MessageTextModel(),
+        markup_cache_size: int | None = None,
+        markup_cache_ttl: float | None = 300,
+        replay_descriptions: bool = False,
+        recorder: Recorder | None = None,
+        breadcrumbs: bool = False,
+        search_trie: bool = False,
+        inline_search: bool = False,
+        cache_size: int | None = None,
+        cache_ttl: float | None = 300,
     ) -> None:
-        prefix = prefix + "_categories"
-        self.repo = CategoryRepo(storage=storage, storage_prefix=prefix).init()
-        self.chain = MessagesChain(storage, prefix=f"{prefix}_chain")
+        """
+        Use `await Category.create(...)`, it also prepares storages
+
+        recorder - times handlers, storage calls and sends and counts round trips per handler
+        breadcrumbs - show path from main category in menu header and back button to parent
+        search_trie - search names in memory instead of storage index, trie is built on setup
+        inline_search - answer inline queries with matching categories, every inline query
+            of the bot comes here, so leave it off when bot has own inline handlers
+        cache_size, cache_ttl - cache categories and listings in memory, see CategoryRepo.create
+        """
+        self.storage = storage
+        self.prefix = prefix + "_categories"
+        self.repo = None
+        self.chain = None
+        self._ready: asyncio.Future | None = None
         if texts.debug:
             texts = MessageTextModel.parse_obj(
                 dict((_, _ + ":" + texts.dict()[_]) for _ in texts.dict().keys())
@@ -43,24 +87,99 @@ class Category:
         self.dispatcher = dispatcher
         self.admin_ids = admin_ids
         self.custom_buttons = buttons
-        self.buttons = CategoryButtons()
-
-
+        self.buttons = CategoryButtons(CategoryCallBackData(), cache_size=markup_cache_size, ttl=markup_cache_ttl)
+        # compiled descriptions, see messages_chain.compile_chain
+        self._plans = LRUCache(maxsize=1024, ttl=600)
+        self.replay_descriptions = replay_descriptions
+        self.recorder = recorder
+        self.breadcrumbs = breadcrumbs
+        # category id: ((id, name), ...) of its ancestors, fetched once per category
+        self._paths = LRUCache(maxsize=4096, ttl=600)
+        self.search_trie = search_trie
+        self._trie: CategoryTrie | None = None
+        self.inline_search = inline_search
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+
+
+
+    @classmethod
+    async def create(cls, *args, **kwargs) -> "Category":
+        """
+        Usage:
+
+        .. code-block:: python3
+
+            category = await Category.create(MongoConnection(db_name='bot'), dp)
+            category.reg_handlers()
+        """
+        category = cls(*args, **kwargs)
+        await category.setup()
+        return category
+
+    @property
+    def ready(self) -> asyncio.Future:
+        """Resolved when storages are ready, awaiting it lets startup code hold traffic until then"""
+        if self._ready is None:
+            self._ready = asyncio.get_running_loop().create_future()
+        return self._ready
+
+    async def setup(self) -> None:
+        try:
+            self.repo, self.chain = await asyncio.gather(
+                CategoryRepo.create(
+                    storage=self.storage, storage_prefix=self.prefix, cache_size=self.cache_size, cache_ttl=self.cache_ttl
+                ),
+                MessagesChain.create(self.dispatcher, prefix=f"{self.prefix}_chain", recorder=self.recorder),
+            )
+        except Exception as e:
+            if not self.ready.done():
+                self.ready.set_exception(e)
+            raise
+        if isinstance(self.repo, CachedStorage):
+            # writes of other code and of other replicas (watch_changes) reach keyboards and descriptions too
+            self.repo.subscribe(self._storage_changed)
+        # cache is inside of Traced, so cache hits are timed too
+        if self.recorder:
+            self.repo = Traced(self.repo, self.recorder, "category.storage")
+            self.chain.repo = Traced(self.chain.repo, self.recorder, "chain.storage")
+        if self.search_trie:
+            self._trie = CategoryTrie.build(await self.repo.get_all_categories() or [])
+        if not self.ready.done():
+            self.ready.set_result(self)
 
     def reg_handlers(self):
         cb = CategoryCallBackData()
         dp = self.dispatcher
-        dp.register_callback_query_handler(self.add_category, cb.control.filter(type=['sub', 'main']))
-        dp.register_callback_query_handler(self.delete_category, cb.control.filter(type='delete'))
-        dp.register_callback_query_handler(self.delete_confirmation, cb.control.filter(type=['save_subs','delete_subs','cancel_deleting']))
-        dp.register_callback_query_handler(self.edit_description, cb.control.filter(type='description'))
-        dp.register_callback_query_handler(self.edit_name, cb.control.filter(type='name'))
-        dp.register_callback_query_handler(self.get_category, cb.control.filter(type=['reorder', 'page']))
-        dp.register_callback_query_handler(self.get_category, cb.category.filter())
-        dp.register_message_handler(self.save_category, state=CategoryStates.description)
-        dp.register_message_handler(self.save_name, state=CategoryStates.name)
-        dp.register_message_handler(self.save_new_name, state=CategoryStates.edit_name)
-        dp.register_message_handler(self.save_new_description, state=CategoryStates.edit_description)
+        h = self._handler
+        dp.register_callback_query_handler(h(self.add_category), cb.control.filter(type=['sub', 'main']))
+        dp.register_callback_query_handler(h(self.delete_category), cb.control.filter(type='delete'))
+        dp.register_callback_query_handler(h(self.delete_confirmation), cb.control.filter(type=['save_subs','delete_subs','cancel_deleting']))
+        dp.register_callback_query_handler(h(self.edit_description), cb.control.filter(type='description'))
+        dp.register_callback_query_handler(h(self.edit_name), cb.control.filter(type='name'))
+        dp.register_callback_query_handler(h(self.get_category), cb.control.filter(type=['reorder', 'page']))
+        dp.register_callback_query_handler(h(self.get_category), cb.category.filter())
+        dp.register_message_handler(h(self.save_category), state=CategoryStates.description)
+        dp.register_message_handler(h(self.save_name), state=CategoryStates.name)
+        dp.register_message_handler(h(self.save_new_name), state=CategoryStates.edit_name)
+        dp.register_message_handler(h(self.save_new_description), state=CategoryStates.edit_description)
+        if self.inline_search:
+            dp.register_inline_handler(h(self.search_inline))
+        dp.register_message_handler(h(self.open_category), CommandStart(deep_link=re.compile(rf"^{DEEP_LINK_PREFIX}[\w-]+$")))
+
+    def _storage_changed(self, ids: Set[str] | None) -> None:
+        if ids is None:
+            self.buttons.clear()
+            self._plans.clear()
+            return
+        self.buttons.invalidate(*ids)
+        for _ in ids:
+            self._plans.pop(_)
+
+    def _handler(self, func):
+        if self.recorder is None:
+            return func
+        return self.recorder.handler(f"category.{func.__name__}", func)
 
     async def try_edit(message: Message, text, markup=None):
         try:
@@ -90,36 +209,138 @@ class Category:
         category = None
 
         if isPage:
-            page_number = int(callback_data.get("id", 1))
+            doc_id, _, page_number = callback_data.get("id", "").partition("|")
+            page_number = int(page_number or 1)
         else:
+            doc_id = callback_data["id"]
             page_number = 1 #TODO: Check
-            category = await self.repo.get_category(callback_data["id"])
+        category = await self.repo.get_category(doc_id)
         if category:
-            if category.description:
+            title, markup = await self._menu(category, page_number, isAdmin, isReorder)
+            if category.description and not isPage:
                 try:
                     await query.message.delete()
                 except Exception:
                     pass
 
-                await self.chain.chain_read(query.message, category.description)
-                subcats = await self.repo.get_subcategories(category.id)
-                await query.message.answer(
-                    category.name,
-                    reply_markup=self.buttons.categories(
-                        subcats or [],
-                        isAdmin=isAdmin,
-                        custom_buttons=self.buttons,
-                        isReorder=isReorder,
-                        page=page_number,
-                        control_text=self.texts.btn_control,
-                    ),
-                )
+                await self.chain.chain_read(query.message, self._plan(category), recorder=self.chain.recorder)
+                await query.message.answer(title, reply_markup=markup)
 
             else:
-                query.message.edit_text(
-                    category.name,
-                    reply_markup=self.buttons.categories([], isAdmin=isAdmin),
+                await query.message.edit_text(title, reply_markup=markup)
+
+    async def _menu(
+        self, category: CategoryModel, page_number: int = 1, isAdmin: bool = False, isReorder: bool = False
+    ) -> Tuple[str, InlineKeyboardMarkup]:
+        parent_id = category.parent_id if self.breadcrumbs else None
+        markup = self.buttons.cached_markup(category.id, page_number, isAdmin, isReorder, parent_id=parent_id)
+        if markup is None:
+            subcats, total = await self.repo.get_subcategories_page(
+                category.id, page_number, self.page_size
+            )
+            markup = self.buttons._categories(
+                subcats,
+                custom_buttons=self.custom_buttons,
+                current_id=category.id,
+                isAdmin=isAdmin,
+                isReorder=isReorder,
+                page=page_number,
+                control_text=self.texts.btn_control,
+                total=total,
+                page_size=self.page_size,
+                parent_id=parent_id,
+                back_text=self.texts.btn_back,
+            )
+        return await self._title(category), markup
+
+    def _plan(self, category: CategoryModel):
+        plan = self._plans.get(category.id)
+        if plan is None:
+            plan = compile_chain(category.description, replay=self.replay_descriptions)
+            self._plans.set(category.id, plan)
+        return plan
+
+    async def search_categories(self, query: str, limit: int | None = None) -> List[CategoryModel]:
+        """Categories by name prefix, from trie when search_trie is on, otherwise from storage index"""
+        limit = limit or self.search_limit
+        if self._trie is None:
+            return await self.repo.search_categories(query, limit)
+        ids = self._trie.search(query, limit)
+        if not ids:
+            return []
+        categories, missing = await self.repo.get_categories(ids, listing=True)
+        # deleted with their parent, trie doesn't know about them
+        for _ in missing:
+            self._trie.remove(_)
+        return categories
+
+    async def search_inline(self, inline_query: InlineQuery) -> None:
+        categories = await self.search_categories(inline_query.query) if inline_query.query.strip() else []
+        me = await inline_query.bot.me
+        results = []
+        for category in categories:
+            link = DEEP_LINK_PREFIX + category.id
+            markup = None
+            if len(link) <= 64:
+                markup = InlineKeyboardMarkup().add(
+                    InlineKeyboardButton(self.texts.btn_open, url=f"https://t.me/{me.username}?start={link}")
                 )
+            results.append(InlineQueryResultArticle(
+                id=category.id[:64],
+                title=category.name,
+                input_message_content=InputTextMessageContent(category.name),
+                reply_markup=markup,
+            ))
+        await inline_query.answer(results, cache_time=30)
+
+    async def open_category(self, message: Message) -> None:
+        """Opens category from deep link made by search_inline"""
+        doc_id = message.get_args()[len(DEEP_LINK_PREFIX):]
+        category = await self.repo.get_category(doc_id)
+        if not category:
+            await message.answer(self.texts.error_found)
+            return
+        title, markup = await self._menu(category, isAdmin=message.from_user.id in self.admin_ids)
+        if category.description:
+            await self.chain.chain_read(message, self._plan(category), recorder=self.chain.recorder)
+        await message.answer(title, reply_markup=markup)
+
+    async def _title(self, category: CategoryModel) -> str:
+        """Category name, with names of its ancestors before it when breadcrumbs are on"""
+        if not self.breadcrumbs or not category.ancestors:
+            return category.name
+        path = self._paths.get(category.id)
+        if path is None:
+            ancestors = await self.repo.get_ancestors(category.id) or []
+            path = tuple((_.id, _.name) for _ in ancestors)
+            self._paths.set(category.id, path)
+        return self.texts.breadcrumb_separator.join([name for _, name in path] + [category.name])
+
+    def _forget_path(self, doc_id: str) -> None:
+        """Drop cached path of doc_id and of every category below it"""
+        self._paths.pop(doc_id)
+        self._paths.pop_where(lambda _, path: any(id == doc_id for id, _ in path))
+
+    async def move_category(self, doc_id: str, parent_id: str) -> CategoryModel | None:
+        """
+        Move category with its branch under parent_id, 'root' makes it main category
+
+        Returns None if category or parent is missing or parent is in the moved branch
+        """
+        category = await self.repo.get_category(doc_id)
+        if not category:
+            return None
+        try:
+            # subcategories of both parents are updated by storage in the same transaction
+            moved = await self.repo.update_parent_id(doc_id, parent_id)
+        except ValueError as e:
+            logging.warning(e)
+            return None
+        if not moved:
+            return None
+        self.buttons.invalidate(doc_id, category.parent_id, parent_id)
+        self._forget_path(doc_id)
+        return moved
 
     async def get_all_categories(self, id: str):
         raise NotImplemented
@@ -134,7 +355,7 @@ class Category:
 
     async def save_name(self, message: Message, state: FSMContext) -> None:
         state.update_data(name=message.html_text)
-        await self.chain.chain_start_write(CategoryStates.description)
+        await self.chain.chain_start_write(state, CategoryStates.description)
         await message.answer(text=self.texts.get_description)
 
     async def save_category(self, message: Message, state: FSMContext) -> None:
@@ -143,10 +364,14 @@ class Category:
         name = await state.get_data("name")
         parent_id = await state.get_data("id")
         query = await state.get_data("query")
-        new_category = await self.repo.add_category(category=CategoryModel(parent_id,name,description))
-        if parent_id !='root' and new_category:
-            await self.repo.update_subcategories(parent_id, [new_category.id])
+        # add_category also adds it to subcategories of parent
+        new_category = await self.repo.add_category(
+            category=CategoryModel(parent_id=parent_id, name=name, description=description)
+        )
         if new_category:
+            self.buttons.invalidate(parent_id)
+            if self._trie is not None:
+                self._trie.add(new_category.id, new_category.name)
             await message.answer(text=self.texts.gategory_saved)
             await self.get_category(CallbackQuery.to_object(query), callback_data={"id":new_category.id})
         else:
@@ -169,6 +394,10 @@ class Category:
                 )
             else:
                 await self.repo.delete_category(id)
+                self.buttons.invalidate(id, category.parent_id)
+                self._forget_path(id)
+                if self._trie is not None:
+                    self._trie.remove(id)
                 await query.message.answer(self.texts.deleted_with_subs)
 
     async def delete_confirmation(
@@ -190,6 +419,11 @@ class Category:
                 await query.message.answer(self.texts.deleted_without_subs)
             case _:
                 await query.message.answer(self.texts.btn_cancel_delete)
+        self.buttons.invalidate(id, category.parent_id, *category.subcategories)
+        self._plans.pop(id)
+        self._forget_path(id)
+        if self._trie is not None and choice != "cancel_deleting":
+            self._trie.remove(id)
         await self.get_category(query, callback_data={''})
 
     async def edit_name(
@@ -204,7 +438,7 @@ class Category:
         self, query: CallbackQuery, state: FSMContext, callback_data: dict
     ) -> None:
         id = callback_data["id"]
-        self.chain.chain_start_write(CategoryStates.edit_description)
+        await self.chain.chain_start_write(state, CategoryStates.edit_description)
         state.update_data(id=id)
         await query.message.answer(self.texts.get_new_description)
 
@@ -214,6 +448,10 @@ class Category:
         name = message.html_text
         category = await self.repo.update_name_category(id, name)
         if category:
+            self.buttons.invalidate(id, category.parent_id)
+            self._forget_path(id)
+            if self._trie is not None:
+                self._trie.add(id, name)
             await message.answer(self.texts.name_updated)
             await self.get_category(id)
         else:
@@ -224,6 +462,7 @@ class Category:
         description =  await self.chain.chain_finish_write(state)
         description = [] if message.html_text == "." else description
         category = await self.repo.update_desciption_category(id, description)
+        self._plans.pop(id)
         if category:
             await message.answer(self.texts.description_updated)
             await self.get_category(id)
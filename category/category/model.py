@@ -1,17 +1,41 @@
 from __future__ import annotations
 from typing import Any, List
 from uuid import uuid4
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, validator
 from messages_chain import ChainModel
 from aiogram.utils.callback_data import CallbackData
 
 class CategoryModel(BaseModel):
     parent_id: str = 'root'
-    id= uuid4().hex
+    id: str = Field(default_factory=lambda: uuid4().hex)
     name: str
     extra: Any | None = None
     description: List[ChainModel] = []
     subcategories:  List[str] = []
+    # ids from main category down to parent, empty for main categories
+    ancestors: List[str] = []
+    # normalized name for search, always computed from name
+    name_key: str = ''
+    # every word start of name_key, prefix index for search
+    name_words: List[str] = []
+
+    @validator('name_key', always=True)
+    def _name_key(cls, value, values):
+        return normalize_name(values.get('name', ''))
+
+    @validator('name_words', always=True)
+    def _name_words(cls, value, values):
+        return word_starts(values.get('name_key', ''))
+
+
+def normalize_name(name: str) -> str:
+    """Case and whitespace insensitive form of name for prefix search"""
+    return " ".join(name.casefold().split())
+
+
+def word_starts(key: str) -> List[str]:
+    """Parts of normalized name from every word start to the end, "a b" gives ["a b", "b"]"""
+    return [key[index:] for index in range(len(key)) if index == 0 or key[index - 1] == " "]
 
 
 class Button(BaseModel):
@@ -25,6 +49,9 @@ class Button(BaseModel):
     own_args: dict
     name: str
 
+    class Config:
+        arbitrary_types_allowed = True
+
 
 class CustomButtonsModel(BaseModel):
     """CustomButtons
@@ -58,6 +85,9 @@ class MessageTextModel(BaseModel):
     save_subcategories_btn_yes: str= "Yes"
     save_subcategories_btn_no: str = "No"
     btn_control: str = "Control Categories"
+    btn_back: str = "⬅️ Back"
+    btn_open: str = "Open"
+    breadcrumb_separator: str = " / "
     btn_cancel_delete:str = "Cancel deleting"
     deleted_with_subs: str = "Category deleted with subcotegories"
     deleted_without_subs: str = "Category deleted, but subcategories moving on one step upper"
@@ -1,10 +1,19 @@
-import asyncio
+import json
+import logging
+from collections import defaultdict
+from typing import Dict, List, TextIO
+
 from aiogram import Dispatcher
-from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo import errors
 
+from messages_chain.mongo_pool import close_clients, get_client, share_aiogram_client
+
 from aiogram import __version__ as AIOGRAM_VERSION
 
+from .model import CategoryModel
+from .storage.base import BaseStorage
+from .storage.cached import CachedStorage
+
 AIOGRAM_VERSION = int(AIOGRAM_VERSION[0])
 
 
@@ -34,23 +43,26 @@ class MongoConnection:
     """
     MongoConnection
 
+    Client comes from shared registry, so connections with equal settings
+    (and chain storage on the same server) use one pool
+
     Usage:
 
     .. code-block:: python3
 
-        storage = MongoStorage(host='localhost', port=27017, db_name='aiogram_fsm')
-        dp = Dispatcher(bot, storage=storage)
+        storage = MongoConnection(db_name='bot', max_pool_size=20, max_idle_time_ms=60000)
+        category = await Category.create(storage, dp)
 
     And need to close Mongo client connections when shutdown
 
     .. code-block:: python3
 
-        await dp.storage.close()
-        await dp.storage.wait_closed()
+        await storage.close()
     """
 
     def __init__(self, host='localhost', port=27017, db_name='support', uri=None,
-                 username=None, password=None, **kwargs):
+                 username=None, password=None, max_pool_size: int | None = None,
+                 min_pool_size: int | None = None, max_idle_time_ms: int | None = None, **kwargs):
         self._host = host
         self._port = port
         self._db_name: str = db_name
@@ -58,67 +70,194 @@ class MongoConnection:
         self._username = username
         self._password = password
         self._kwargs = kwargs  # custom client options like SSL configuration, etc.
+        if max_pool_size is not None:
+            self._kwargs["maxPoolSize"] = max_pool_size
+        if min_pool_size is not None:
+            self._kwargs["minPoolSize"] = min_pool_size
+        if max_idle_time_ms is not None:
+            self._kwargs["maxIdleTimeMS"] = max_idle_time_ms
 
-        if self._uri:
-            try:
-                self._mongo = AsyncIOMotorClient(self._uri, **self._kwargs)
-            except errors.ConfigurationError as e:
-                if "query() got an unexpected keyword argument 'lifetime'" in e.args[0]:
-                    import logging
-                    logger = logging.getLogger("aiogram")
-                    logger.warning("Run `pip install dnspython==1.16.0` in order to fix ConfigurationError. More information: https://github.com/mongodb/mongo-python-driver/pull/423#issuecomment-528998245")
-                raise e
+        if not uri:
+            uri = 'mongodb://'
 
+            # set username + password
+            if self._username and self._password:
+                uri += f'{self._username}:{self._password}@'
 
-        uri = 'mongodb://'
+            # set host and port (optional)
+            uri += f'{self._host}:{self._port}' if self._host else f'localhost:{self._port}'
 
-        # set username + password
-        if self._username and self._password:
-            uri += f'{self._username}:{self._password}@'
-
-        # set host and port (optional)
-        uri += f'{self._host}:{self._port}' if self._host else f'localhost:{self._port}'
-
-        # define and return client
-        self._mongo = AsyncIOMotorClient(uri)
+        try:
+            self._mongo = get_client(uri, **self._kwargs)
+        except errors.ConfigurationError as e:
+            if "query() got an unexpected keyword argument 'lifetime'" in e.args[0]:
+                import logging
+                logger = logging.getLogger("aiogram")
+                logger.warning("Run `pip install dnspython==1.16.0` in order to fix ConfigurationError. More information: https://github.com/mongodb/mongo-python-driver/pull/423#issuecomment-528998245")
+            raise e
 
 
     def get_mongo(self):
         return self._mongo.get_database(self._db_name)
 
+    async def close(self) -> None:
+        """Close all shared clients, other modules lose their connections too"""
+        close_clients()
+
 
 
 
 class CategoryRepo:
-    def __init__(self, storage: Dispatcher  | MongoConnection, storage_prefix:str| None, ttl: int = 2) -> None:
+    def __init__(
+        self,
+        storage: Dispatcher  | MongoConnection,
+        storage_prefix:str| None,
+        ttl: int = 2,
+        cache_size: int | None = None,
+        cache_ttl: float | None = 300,
+    ) -> None:
         self.storage= storage
         self.prefix = storage_prefix
         self.ttl = ttl
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
 
-    def init(self) ->   MongoStorage :
+    @classmethod
+    async def create(
+        cls,
+        storage: Dispatcher  | MongoConnection,
+        storage_prefix:str| None = None,
+        ttl: int = 2,
+        cache_size: int | None = None,
+        cache_ttl: float | None = 300,
+    ) -> MongoStorage | CachedStorage:
+        """
+        Category storage with collections and indexes created
+
+        cache_size - keep up to that many categories and listings in memory
+        for cache_ttl seconds (see CachedStorage), None disables the cache
+
+        Usage:
+
+        .. code-block:: python3
+
+            repo = await CategoryRepo.create(MongoConnection(db_name='bot'), cache_size=4096)
+        """
+        return await cls(storage, storage_prefix, ttl, cache_size, cache_ttl).init()
+
+    async def init(self) ->   MongoStorage | CachedStorage :
         type_storage = type(self.storage)
         match type_storage.__name__:
             case 'Dispatcher':
-                loop = asyncio.get_event_loop()
+                repo = await self._wrap_storage(self.storage.storage)
 
-                if loop.is_closed():
-                    loop = asyncio.new_event_loop()
-                    return loop.run_until_complete(self._wrap_storage(self.storage.get_current().storage))
+            case 'MongoConnection':
+                repo = MongoStorage(self.storage.get_mongo())
 
-                else:
-                    return loop.create_task(self._wrap_storage(self.storage.get_current().storage))
+            case _:
+                raise ValueError(f"{type_storage} is unsupported storage")
 
-            case 'MongoConnection':
-                return MongoStorage(self.storage.get_mongo())
+        if self.cache_size:
+            repo = CachedStorage(repo, self.cache_size, self.cache_ttl)
+        await repo.init()
+        return repo
 
 
-    async def _wrap_storage(self, storage: AiogramMemoryStorage|AiogramMongoStorage) ->   MongoStorage | None:
+    async def _wrap_storage(self, storage: AiogramMemoryStorage|AiogramMongoStorage) ->   MongoStorage:
         storage_type = type(storage)
 
         if MONGO_INSTALLED:
             if storage_type is AiogramMongoStorage:
+                share_aiogram_client(storage)
                 mongo: motor_asyncio.AsyncIOMotorDatabase = await storage.get_db()
                 return MongoStorage(db=mongo)
 
-        else:
-            raise ValueError(f"{storage_type} is unsupported storage")
+        raise ValueError(f"{storage_type} is unsupported storage")
+
+    @staticmethod
+    async def export_tree(repo: BaseStorage, fp: TextIO, batch_size: int = 1000) -> int:
+        """
+        Write every category with its description to fp, one json per line
+
+        Paths are not written, import_tree computes them again. Returns count of written categories
+
+        Usage:
+
+        .. code-block:: python3
+
+            with open("catalog.ndjson", "w") as fp:
+                await CategoryRepo.export_tree(repo, fp)
+        """
+        count = 0
+        async for data in repo.export_categories(batch_size):
+            data.pop("ancestors", None)
+            fp.write(json.dumps(data, ensure_ascii=False, default=str) + "\n")
+            count += 1
+        return count
+
+    @staticmethod
+    async def import_tree(repo: BaseStorage, fp: TextIO, batch_size: int = 1000) -> int:
+        """
+        Insert categories from ndjson written by export_tree
+
+        Whole file is checked before writing: ids must be unique and not in repo yet,
+        parents must be in the file or in repo and have no cycles, otherwise ValueError is raised.
+        Paths and subcategories are computed here (order of exported subcategories is kept),
+        categories are written with unordered insert_many in batches of batch_size.
+        Returns count of inserted categories
+        """
+        categories: Dict[str, CategoryModel] = {}
+        for number, line in enumerate(fp, 1):
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line)
+            if not data.get("id"):
+                raise ValueError(f"Line {number}: category without id")
+            if data["id"] in categories:
+                raise ValueError(f"Line {number}: duplicate category {data['id']}")
+            categories[data["id"]] = CategoryModel.parse_obj(data)
+
+        outside = list(set(
+            _.parent_id for _ in categories.values()
+            if _.parent_id != 'root' and _.parent_id not in categories
+        ))
+        # ids of the file and parents outside of it are read with one call
+        found, missing = await repo.get_categories(outside + list(categories), listing=True)
+        taken = [_.id for _ in found if _.id in categories]
+        if taken:
+            raise ValueError(f"Categories already exist: {', '.join(taken[:10])}")
+        missing = [_ for _ in missing if _ not in categories]
+        if missing:
+            raise ValueError(f"Parents not found: {', '.join(missing[:10])}")
+
+        paths: Dict[str, List[str]] = dict((_.id, _.ancestors + [_.id]) for _ in found)
+        paths['root'] = []
+        for doc_id in categories:
+            chain = []
+            current = doc_id
+            while current not in paths:
+                if current in chain:
+                    raise ValueError(f"Category {current} has cycle in parents")
+                chain.append(current)
+                current = categories[current].parent_id
+            for _ in reversed(chain):
+                category = categories[_]
+                category.ancestors = paths[category.parent_id]
+                paths[_] = category.ancestors + [_]
+
+        children: Dict[str, List[str]] = defaultdict(list)
+        for category in categories.values():
+            children[category.parent_id].append(category.id)
+        for category in categories.values():
+            own = children.pop(category.id, [])
+            listed = [_ for _ in dict.fromkeys(category.subcategories) if _ in own]
+            seen = set(listed)
+            category.subcategories = listed + [_ for _ in own if _ not in seen]
+
+        inserted = await repo.insert_categories(list(categories.values()), batch_size)
+        children.pop('root', None)
+        for parent_id, ids in children.items():
+            await repo.update_subcategories(parent_id, ids)
+        logging.info(f"Imported {inserted} of {len(categories)} categories")
+        return inserted
@@ -0,0 +1,74 @@
+from typing import Dict, Iterable, List
+
+from .model import CategoryModel, normalize_name, word_starts
+
+_IDS = ""  # key of ids set in trie node, never a character of indexed text
+
+
+class CategoryTrie:
+    """
+    In-memory prefix index of category names
+
+    Every word start of normalized name is indexed, so "sho" finds
+    "Running shoes" too. Use it when whole catalog fits into memory,
+    otherwise search_categories of storage does the same with an index.
+    """
+
+    def __init__(self) -> None:
+        self._root: Dict = {}
+        self._keys: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    @classmethod
+    def build(cls, categories: Iterable[CategoryModel]) -> "CategoryTrie":
+        trie = cls()
+        for category in categories:
+            trie.add(category.id, category.name)
+        return trie
+
+    def add(self, category_id: str, name: str) -> None:
+        self.remove(category_id)
+        key = normalize_name(name)
+        self._keys[category_id] = key
+        for suffix in word_starts(key):
+            node = self._root
+            for char in suffix:
+                node = node.setdefault(char, {})
+            node.setdefault(_IDS, set()).add(category_id)
+
+    def remove(self, category_id: str) -> None:
+        key = self._keys.pop(category_id, None)
+        if key is None:
+            return
+        for suffix in word_starts(key):
+            node = self._root
+            for char in suffix:
+                node = node.get(char)
+                if node is None:
+                    break
+            else:
+                node.get(_IDS, set()).discard(category_id)
+
+    def search(self, query: str, limit: int = 10) -> List[str]:
+        """Ids of categories with a word starting with query, shorter matches first"""
+        node = self._root
+        for char in normalize_name(query):
+            node = node.get(char)
+            if node is None:
+                return []
+        found: List[str] = []
+        seen = set()
+        # breadth-first, so closer (shorter) matches come first
+        level: List[Dict] = [node]
+        while level and len(found) < limit:
+            next_level = []
+            for current in level:
+                for category_id in sorted(current.get(_IDS, ())):
+                    if category_id not in seen:
+                        seen.add(category_id)
+                        found.append(category_id)
+                next_level.extend(current[char] for char in sorted(current) if char != _IDS)
+            level = next_level
+        return found[:limit]
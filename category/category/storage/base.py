@@ -1,28 +1,81 @@
 from abc import abstractmethod, ABC
-from typing import List
-from ..model import CategoryModel
+from typing import AsyncIterator, List, Tuple
+from ..model import CategoryModel, ChainModel
 
 
 
 class BaseStorage(ABC):
+    """
+    get_category and get_categories return whole categories, listing methods
+    (subcategories, branch, descendants, ancestors, all categories, search)
+    may leave description and extra empty, open category with get_category to read them
+    """
+
+    async def init(self) -> None:
+        """Create collections and indexes, awaited once before the first request"""
+        pass
 
     @abstractmethod
     async def get_category(self,doc_id: str) -> CategoryModel| None:
         raise NotImplementedError
 
+    @abstractmethod
+    async def get_categories(self,ids: List[str], listing: bool = False) -> Tuple[List[CategoryModel], List[str]]:
+        """
+        Categories in order of ids and list of ids which were not found
+
+        listing - load only fields of listing methods, description and extra may be empty"""
+        raise NotImplementedError
+
     @abstractmethod
     async def get_subcategories(self,doc_id: str) -> List[CategoryModel]| None:
         raise NotImplementedError
 
     @abstractmethod
-    async def get_branch_categories(self,doc_id: str) -> List[CategoryModel]| None:
-        # use get childs clouthers
+    async def get_subcategories_page(self,doc_id: str, page: int = 1, page_size: int = 6) -> Tuple[List[CategoryModel], int]:
+        """One page of subcategories and total count of subcategories"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_branch_categories(self,doc_id: str, max_depth: int | None = None) -> List[CategoryModel]| None:
+        """All descendants of doc_id, flat and breadth-first, down to max_depth levels"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_descendants(self,doc_id: str) -> List[CategoryModel]| None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_ancestors(self,doc_id: str) -> List[CategoryModel]| None:
+        """Breadcrumb of doc_id from the main category down to the parent"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_depth(self,doc_id: str) -> int| None:
         raise NotImplementedError
 
     @abstractmethod
     async def get_all_categories() -> List[CategoryModel]| None:
         raise NotImplementedError
 
+    @abstractmethod
+    async def search_categories(self, query: str, limit: int = 10) -> List[CategoryModel]:
+        """Categories which normalized name starts with normalized query, by name"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def export_categories(self, batch_size: int = 1000) -> AsyncIterator[dict]:
+        """Every category as plain dict, streamed in batches of batch_size"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def insert_categories(self, categories: List[CategoryModel], batch_size: int = 1000) -> int:
+        """
+        Insert prepared categories as they are, parents, paths and subcategories are not touched
+
+        Returns count of inserted categories"""
+        raise NotImplementedError
+
     @abstractmethod
     async def add_category(self,category: CategoryModel) -> CategoryModel:
 
@@ -38,12 +91,17 @@ class BaseStorage(ABC):
         Or Save and connect them to parent"""
         raise NotImplementedError
 
+    @abstractmethod
+    async def patch_category(self,doc_id: str, **fields) -> CategoryModel| None:
+        """Update several fields in one write"""
+        raise NotImplementedError
+
     @abstractmethod
     async def update_name_category(self,doc_id: str, name: str) -> CategoryModel:
         raise NotImplementedError
 
     @abstractmethod
-    async def update_desciption_category(self,doc_id: str, description: str) -> CategoryModel:
+    async def update_desciption_category(self,doc_id: str, description: List[ChainModel]) -> CategoryModel:
         raise NotImplementedError
 
     @abstractmethod
@@ -0,0 +1,241 @@
+import logging
+from typing import AsyncIterator, Callable, List, Set, Tuple
+from typing import TYPE_CHECKING
+from pymongo.errors import OperationFailure
+from ..cache import LRUCache
+from ..model import CategoryModel, ChainModel
+from .base import BaseStorage
+
+if TYPE_CHECKING:
+    from motor import motor_asyncio
+
+
+
+class CachedStorage(BaseStorage):
+    """
+    Read-through cache around any BaseStorage
+
+    Keeps categories and subcategory listings in memory, writes made through
+    this wrapper drop only the entries they touch. subscribe() lets caches built
+    on top of categories follow the same writes.
+
+    Usage:
+
+    .. code-block:: python3
+
+        repo = CachedStorage(MongoStorage(db), maxsize=4096, ttl=300)
+        # optional, keeps several bot replicas coherent (needs replica set)
+        asyncio.create_task(repo.watch_changes(collection))
+    """
+
+    def __init__(self, storage: BaseStorage, maxsize: int = 1024, ttl: float | None = 300) -> None:
+        self.storage = storage
+        self._categories = LRUCache(maxsize, ttl)
+        self._subcategories = LRUCache(maxsize, ttl)
+        # (doc_id, page, page_size): (categories, total)
+        self._pages = LRUCache(maxsize, ttl)
+        self._listeners: List[Callable[[Set[str] | None], None]] = []
+
+    async def init(self) -> None:
+        await self.storage.init()
+
+    def subscribe(self, listener: Callable[[Set[str] | None], None]) -> None:
+        """
+        listener(ids) is called after every write seen by this wrapper (own writes and watch_changes),
+        ids are changed categories and their parents, None when anything may have changed
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, ids: Set[str] | None) -> None:
+        for listener in self._listeners:
+            listener(ids)
+
+    def invalidate(self, doc_id: str, *categories: CategoryModel | None) -> None:
+        """
+        Forget category, its listing and every parent, listing or path it is part of
+
+        categories - doc_id as storage returned it after the write, its parent is dropped too
+        """
+        changed = {doc_id}
+        cached: CategoryModel | None = self._categories.pop(doc_id)
+        for category in (cached, *categories):
+            if category:
+                changed.add(category.parent_id)
+        # parents which are cached, though category itself is not
+        changed.update(cat.id for _, cat in self._categories.items() if doc_id in cat.subcategories)
+        changed.update(key for key, cats in self._subcategories.items() if any(cat.id == doc_id for cat in cats))
+        changed.update(key[0] for key, page in self._pages.items() if any(cat.id == doc_id for cat in page[0]))
+        for _ in changed:
+            self._categories.pop(_)
+            self._forget_listing(_)
+        self._categories.pop_where(lambda _, cat: doc_id in cat.ancestors or cat.parent_id == doc_id)
+        self._notify(changed)
+
+    def clear(self) -> None:
+        self._categories.clear()
+        self._subcategories.clear()
+        self._pages.clear()
+        self._notify(None)
+
+    def _forget_listing(self, doc_id: str) -> None:
+        """Drop subcategories listing of doc_id and all its pages"""
+        self._subcategories.pop(doc_id)
+        self._pages.pop_where(lambda key, _: key[0] == doc_id)
+
+    async def get_category(self, doc_id: str) -> CategoryModel | None:
+        category = self._categories.get(doc_id)
+        if category is None:
+            category = await self.storage.get_category(doc_id)
+            if category:
+                self._categories.set(doc_id, category)
+        return category
+
+    async def get_categories(self, ids: List[str], listing: bool = False) -> Tuple[List[CategoryModel], List[str]]:
+        found = dict((_, self._categories.get(_)) for _ in ids)
+        fetch = [_ for _, category in found.items() if category is None]
+        if fetch:
+            categories, _ = await self.storage.get_categories(fetch, listing)
+            for category in categories:
+                # cache keeps whole categories only
+                if not listing:
+                    self._categories.set(category.id, category)
+                found[category.id] = category
+        categories = [found[_] for _ in ids if found[_] is not None]
+        missing = [_ for _ in ids if found[_] is None]
+        return categories, missing
+
+    async def get_subcategories(self, doc_id: str) -> List[CategoryModel] | None:
+        categories = self._subcategories.get(doc_id)
+        if categories is None:
+            categories = await self.storage.get_subcategories(doc_id)
+            if categories is not None:
+                # listed categories have no description, so they are not put into categories cache
+                self._subcategories.set(doc_id, categories)
+        return categories
+
+    async def get_subcategories_page(self, doc_id: str, page: int = 1, page_size: int = 6) -> Tuple[List[CategoryModel], int]:
+        categories = self._subcategories.get(doc_id)
+        if categories is not None:
+            start = (max(page, 1) - 1) * page_size
+            return categories[start:start + page_size], len(categories)
+        key = (doc_id, page, page_size)
+        result = self._pages.get(key)
+        if result is None:
+            result = await self.storage.get_subcategories_page(doc_id, page, page_size)
+            # empty result may be an error, it is not kept
+            if result[1]:
+                self._pages.set(key, result)
+        return result
+
+    async def get_branch_categories(self, doc_id: str, max_depth: int | None = None) -> List[CategoryModel] | None:
+        return await self.storage.get_branch_categories(doc_id, max_depth)
+
+    async def get_descendants(self, doc_id: str) -> List[CategoryModel] | None:
+        return await self.storage.get_descendants(doc_id)
+
+    async def get_ancestors(self, doc_id: str) -> List[CategoryModel] | None:
+        return await self.storage.get_ancestors(doc_id)
+
+    async def get_depth(self, doc_id: str) -> int | None:
+        category = await self.get_category(doc_id)
+        if category:
+            return len(category.ancestors)
+        return None
+
+    async def get_all_categories(self) -> List[CategoryModel] | None:
+        return await self.storage.get_all_categories()
+
+    async def search_categories(self, query: str, limit: int = 10) -> List[CategoryModel]:
+        return await self.storage.search_categories(query, limit)
+
+    def export_categories(self, batch_size: int = 1000) -> AsyncIterator[dict]:
+        return self.storage.export_categories(batch_size)
+
+    async def insert_categories(self, categories: List[CategoryModel], batch_size: int = 1000) -> int:
+        try:
+            return await self.storage.insert_categories(categories, batch_size)
+        finally:
+            self.clear()
+
+    async def add_category(self, category: CategoryModel) -> CategoryModel | None:
+        new_category = await self.storage.add_category(category)
+        self._categories.pop(category.parent_id)
+        self._forget_listing(category.parent_id)
+        self._notify({category.parent_id})
+        return new_category
+
+    async def delete_category(self, doc_id: str, saveChilderns: bool = False) -> None:
+        try:
+            return await self.storage.delete_category(doc_id, saveChilderns)
+        finally:
+            self.invalidate(doc_id)
+
+    async def update_name_category(self, doc_id: str, name: str) -> CategoryModel:
+        category = None
+        try:
+            category = await self.storage.update_name_category(doc_id, name)
+            return category
+        finally:
+            self.invalidate(doc_id, category)
+
+    async def update_desciption_category(self, doc_id: str, description: List[ChainModel]) -> CategoryModel:
+        category = None
+        try:
+            category = await self.storage.update_desciption_category(doc_id, description)
+            return category
+        finally:
+            self.invalidate(doc_id, category)
+
+    async def update_parent_id(self, doc_id: str, parent_id: str) -> CategoryModel:
+        category = None
+        try:
+            category = await self.storage.update_parent_id(doc_id, parent_id)
+            return category
+        finally:
+            self.invalidate(doc_id, category)
+            self._categories.pop(parent_id)
+            self._forget_listing(parent_id)
+
+    async def update_subcategories(self, doc_id: str, subcategories: List[str]) -> CategoryModel:
+        try:
+            return await self.storage.update_subcategories(doc_id, subcategories)
+        finally:
+            self._categories.pop(doc_id)
+            self._forget_listing(doc_id)
+            self._notify({doc_id})
+
+    async def patch_category(self, doc_id: str, **fields) -> CategoryModel | None:
+        category = None
+        try:
+            category = await self.storage.patch_category(doc_id, **fields)
+            return category
+        finally:
+            self.invalidate(doc_id, category)
+
+    async def update_extra_category(self, doc_id: str, extra: str) -> CategoryModel:
+        category = None
+        try:
+            category = await self.storage.update_extra_category(doc_id, extra)
+            return category
+        finally:
+            self.invalidate(doc_id, category)
+
+    async def watch_changes(self, collection: "motor_asyncio.AsyncIOMotorCollection") -> None:
+        """
+        Invalidate entries changed by other processes through MongoDB change stream
+
+        Runs until cancelled, change streams need replica set or sharded cluster"""
+        try:
+            async with collection.watch(full_document="updateLookup") as stream:
+                async for change in stream:
+                    doc_id = change.get("documentKey", {}).get("_id")
+                    if doc_id is None:
+                        self.clear()
+                        continue
+                    document = change.get("fullDocument")
+                    category = None
+                    if document:
+                        category = CategoryModel.construct(id=doc_id, parent_id=document.get("parent_id", "root"))
+                    self.invalidate(doc_id, category)
+        except OperationFailure as e:
+            logging.error(e)
@@ -1,181 +1,488 @@
 import asyncio
 import logging
-from typing import List
-from typing import TYPE_CHECKING
 import itertools
-from ..model import CategoryModel
+import re
+from uuid import uuid4
+from typing import AsyncIterator, List, Tuple
+from typing import TYPE_CHECKING
+from pydantic import BaseModel, Field
+from pymongo import ASCENDING, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+from messages_chain import ChainRecord
+from ..model import CategoryModel, ChainModel, normalize_name, word_starts
 from .base import BaseStorage
 
+from beanie import Document, init_beanie
+
 if TYPE_CHECKING:
     from motor import motor_asyncio
-    from beanie import Document, init_beanie
-    from beanie.operators import  Set
 
 
 
 
 
 class MongoStorage(BaseStorage):
+    max_batch_size = 1000
+    # fields loaded by listing queries, description and extra are loaded only with get_category
+    listing_projection = {"name": 1, "parent_id": 1, "subcategories": 1, "ancestors": 1}
+    # main categories have no subcategories list to keep their order, pages need a stable one
+    root_sort = {"name": 1, "_id": 1}
+
     def __init__(self, db: "motor_asyncio.AsyncIOMotorDatabase"):
         class MongoCategoryModel(Document,CategoryModel):
-            pass
+            # categories use string ids (uuid hex), not ObjectId
+            id: str = Field(default_factory=lambda: uuid4().hex, alias="_id")
+
+            class Settings:
+                indexes = [
+                    IndexModel([("ancestors", ASCENDING), ("parent_id", ASCENDING)]),
+                    IndexModel([("parent_id", ASCENDING), ("name", ASCENDING), ("_id", ASCENDING)]),
+                    IndexModel([("name_words", ASCENDING)]),
+                ]
         self.document= MongoCategoryModel
-        loop = asyncio.get_event_loop()
+        self._db = db
 
-        #  This happens when MongoDB driver is used as storage_driver argument
-        if loop.is_closed():
-            loop = asyncio.new_event_loop()
-            loop.run_until_complete(init_beanie(database=db, document_models=[MongoCategoryModel]))
-            loop.close()
-        else:
-            loop.create_task(init_beanie(database=db, document_models=[MongoCategoryModel]))
+    async def init(self) -> None:
+        await init_beanie(database=self._db, document_models=[self.document])
 
+    @classmethod
+    def _embedded_projection(cls, field: str) -> dict:
+        """listing_projection for documents embedded into field, e.g. by $lookup"""
+        return dict((f"{field}.{key}", value) for key, value in {"_id": 1, **cls.listing_projection}.items())
+
+    def _trusted(self, data: dict) -> CategoryModel:
+        """Build category from stored document without validation, description is read as compact records"""
+        data["description"] = [ChainRecord.from_dict(_) for _ in data.get("description", [])]
+        if "_id" in data:
+            data["id"] = data.pop("_id")
+        return self.document.construct(**data)
 
     async def get_category(self,doc_id: str) -> CategoryModel | None:
-        return await  self.document.get(doc_id)
+        try:
+            data = await self.document.get_motor_collection().find_one({"_id": doc_id})
+            return self._trusted(data) if data else None
+        except Exception as e:
+            logging.error(e)
+            return None
+
+
+    async def get_categories(self, ids: List[str], listing: bool = False) -> Tuple[List[CategoryModel], List[str]]:
+        """
+        Fetch categories by ids with $in queries of at most max_batch_size ids
+
+        listing - load only listing_projection fields
+        Returns found categories in order of ids and list of missing ids"""
+        collection = self.document.get_motor_collection()
+        projection = self.listing_projection if listing else None
+        batches = [ids[_:_ + self.max_batch_size] for _ in range(0, len(ids), self.max_batch_size)]
+        try:
+            results = await asyncio.gather(
+                *(collection.find({"_id": {"$in": batch}}, projection).to_list(None) for batch in batches)
+            )
+        except Exception as e:
+            logging.error(e)
+            return [], list(ids)
+        found = dict((_["_id"], self._trusted(_)) for _ in itertools.chain(*results))
+        categories = [found[_] for _ in ids if _ in found]
+        missing = [_ for _ in ids if _ not in found]
+        return categories, missing
 
+    async def _listing(self, query: dict, sort: dict | None = None) -> List[CategoryModel]:
+        cursor = self.document.get_motor_collection().find(query, self.listing_projection)
+        if sort:
+            cursor = cursor.sort(list(sort.items()))
+        return [self._trusted(_) async for _ in cursor]
 
     async def get_subcategories(self,doc_id: str) -> List[CategoryModel] | None:
         try:
-            category = await self.get_category(doc_id)
-            if category:
-                return await self.document.find_many([category.subcategories])
+            if doc_id == 'root':
+                return await self._listing({"parent_id": "root"}, self.root_sort)
+            parent = await self.document.get_motor_collection().find_one({"_id": doc_id}, {"subcategories": 1})
+            if parent:
+                ids = parent.get("subcategories", [])
+                batches = [ids[_:_ + self.max_batch_size] for _ in range(0, len(ids), self.max_batch_size)]
+                results = await asyncio.gather(*(self._listing({"_id": {"$in": batch}}) for batch in batches))
+                found = dict((category.id, category) for category in itertools.chain(*results))
+                missing = [_ for _ in ids if _ not in found]
+                if missing:
+                    logging.warning(f"Category {doc_id} has missing subcategories {missing}")
+                return [found[_] for _ in ids if _ in found]
             return None
         except Exception as e:
             logging.error(e)
             return None
 
-    async def get_branch_categories(self,doc_id: str) -> List[CategoryModel] | None:
+    async def get_subcategories_page(self, doc_id: str, page: int = 1, page_size: int = 6) -> Tuple[List[CategoryModel], int]:
+        """One page of subcategories in their order and total count of subcategories"""
         try:
-            categories = []
-            category = await self.document.get(doc_id)
-            if category:
-                subcats = await self.get_subcategories(doc_id)
-                if subcats:
-                    categories.extend(subcats)
-                    for sub in subcats:
-                        cats = await self.get_branch_categories(sub.id)
-                        categories.append(cats)
-                else:
-                    return categories
+            skip = (max(page, 1) - 1) * page_size
+            collection_name = self.document.get_motor_collection().name
+            if doc_id == 'root':
+                pipeline = [
+                    {"$match": {"parent_id": "root"}},
+                    {"$facet": {
+                        "page": [{"$sort": self.root_sort}, {"$skip": skip}, {"$limit": page_size}, {"$project": self.listing_projection}],
+                        "total": [{"$count": "count"}],
+                    }},
+                    {"$project": {"page": 1, "total": {"$ifNull": [{"$first": "$total.count"}, 0]}}},
+                ]
+            else:
+                pipeline = [
+                    {"$match": {"_id": doc_id}},
+                    {"$project": {
+                        "total": {"$size": "$subcategories"},
+                        "ids": {"$slice": ["$subcategories", skip, page_size]},
+                    }},
+                    # plain $lookup, lookup with both localField and pipeline needs MongoDB 5.0
+                    {"$lookup": {"from": collection_name, "localField": "ids", "foreignField": "_id", "as": "page"}},
+                    {"$project": {"total": 1, "ids": 1, **self._embedded_projection("page")}},
+                ]
+            result = await self.document.aggregate(pipeline).to_list()
+            if not result:
+                return [], 0
+            page_documents = result[0]["page"]
+            ids = result[0].get("ids")
+            if ids is not None:
+                # $lookup does not keep the order of localField
+                by_id = dict((_["_id"], _) for _ in page_documents)
+                page_documents = [by_id[_] for _ in ids if _ in by_id]
+            return [self._trusted(_) for _ in page_documents], result[0]["total"]
+        except Exception as e:
+            logging.error(e)
+            return [], 0
+
+    async def get_branch_categories(self,doc_id: str, max_depth: int | None = None) -> List[CategoryModel] | None:
+        """
+        Load the whole branch under doc_id by its indexed ancestors paths
+
+        Result is flat and in breadth-first order, doc_id itself is not included
+
+        max_depth - how many levels below doc_id to load, None for the whole branch"""
+        try:
+            # paths of the branch share the prefix up to doc_id, so length of path is depth
+            pipeline = [
+                {"$match": {"ancestors": doc_id}},
+                {"$addFields": {"depth": {"$size": "$ancestors"}}},
+            ]
+            if max_depth is not None:
+                if max_depth < 1:
+                    return []
+                category = await self.document.get_motor_collection().find_one({"_id": doc_id}, {"ancestors": 1})
+                if category is None:
+                    return []
+                pipeline.append({"$match": {"depth": {"$lte": len(category.get("ancestors", [])) + max_depth}}})
+            pipeline += [
+                {"$sort": {"depth": 1, "_id": 1}},
+                {"$project": self.listing_projection},
+            ]
+            branch = await self.document.aggregate(pipeline).to_list()
+            return [self._trusted(_) for _ in branch]
         except Exception as e:
             logging.error(e)
             return None
 
-    async def get_all_categories(self) -> List[CategoryModel] | None:
+    async def get_descendants(self,doc_id: str) -> List[CategoryModel] | None:
         try:
-            root_categories = await self.document.find({"id": "root"}).to_list()
-            all_categories = []
-            for branch in root_categories:
-                all_categories.append(self.get_branch_categories(branch.id))
+            return await self._listing({"ancestors": doc_id})
         except Exception as e:
             logging.error(e)
             return None
 
-    async def add_category(self, category: CategoryModel) -> CategoryModel | None:
+    async def get_ancestors(self,doc_id: str) -> List[CategoryModel] | None:
         try:
-            new_category =  await self.document.insert_one(category)
-            if category.parent_id != 'root':
-                parent  = await self.document.get(category.parent_id)
-                parent.subcategories.append(category.id)
-                await self.update_subcategories(parent.id, parent.subcategories)
-            return new_category
+            pipeline = [
+                {"$match": {"_id": doc_id}},
+                {"$lookup": {
+                    "from": self.document.get_motor_collection().name,
+                    "localField": "ancestors",
+                    "foreignField": "_id",
+                    "as": "breadcrumb",
+                }},
+                {"$project": {"ancestors": 1, **self._embedded_projection("breadcrumb")}},
+            ]
+            result = await self.document.aggregate(pipeline).to_list()
+            if not result:
+                return None
+            # $lookup does not keep the order of localField
+            by_id = dict((_["_id"], _) for _ in result[0]["breadcrumb"])
+            return [self._trusted(by_id[_]) for _ in result[0]["ancestors"] if _ in by_id]
         except Exception as e:
             logging.error(e)
             return None
 
+    async def get_depth(self,doc_id: str) -> int | None:
+        category = await self.get_category(doc_id)
+        if category:
+            return len(category.ancestors)
+        return None
 
-    async def delete_category(self, doc_id: str, saveChilderns: bool = False) ->  None:
-        try:
-            category = await self.get_category(doc_id)
-            if category:
-                if  not category.subcategories:
-                    await self.document.delete(doc_id)
-                    return
-
-                if saveChilderns:
-                    if category.parent_id == 'root':
-                        for cat in category.subcategories:
-                            self.update_parent_id(cat, 'root')
-                    else:
-                        parent = await self.get_category(category.parent_id)
-                        parent.subcategories.pop(parent.subcategories.index(category.id))
-                        parent.subcategories.extend(category.subcategories)
-                        await self.update_subcategories(parent.subcategories,parent.id)
-                else:
-                    if category.parent_id != 'root':
-                        parent = await self.get_category(category.parent_id)
-                        parent.subcategories.pop(parent.subcategories.index(category.id))
-                        await self.update_subcategories(parent.subcategories,parent.id)
+    async def _ancestors_for(self, parent_id: str, session=None) -> List[str]:
+        if parent_id == 'root':
+            return []
+        parent = await self.document.get_motor_collection().find_one(
+            {"_id": parent_id}, {"ancestors": 1}, session=session
+        )
+        if parent is None:
+            raise ValueError(f"Parent category {parent_id} not found")
+        return parent.get("ancestors", []) + [parent_id]
+
+    async def _rebase_descendants(self, doc_id: str, old: List[str], ancestors: List[str], session=None) -> None:
+        """Replace old, the path above doc_id, with ancestors in paths of descendants"""
+        collection = self.document.get_motor_collection()
+        # ids in a path are unique, so old part can be pulled by value
+        if old:
+            await collection.update_many({"ancestors": doc_id}, {"$pull": {"ancestors": {"$in": old}}}, session=session)
+        if ancestors:
+            await collection.update_many(
+                {"ancestors": doc_id}, {"$push": {"ancestors": {"$each": ancestors, "$position": 0}}}, session=session
+            )
+
+    async def backfill_ancestors(self, batch_size: int = 1000) -> int:
+        """
+        Migration for collections created before ancestors field
+
+        Computes path of every category from parent_id and writes it back, returns count of updated categories"""
+        collection = self.document.get_motor_collection()
+        parents = {}
+        async for _ in collection.find({}, {"parent_id": 1}):
+            parents[_["_id"]] = _.get("parent_id", "root")
 
-                    branch = self.get_branch_categories(doc_id)
-                    deletly_categories: List[CategoryModel] = list(itertools.chain(*branch))
-                    deletly_categories.append(category)
-                    for _ in deletly_categories:
-                        await self.document.delete(_.id)
+        paths = {}
+        for doc_id in parents:
+            chain = []
+            current = doc_id
+            while current not in paths:
+                parent = parents[current]
+                if parent not in parents or parent == current or parent in chain:
+                    if parent in chain or parent == current:
+                        logging.error(f"Category {current} has cycle in parents")
+                    paths[current] = []
+                    break
+                chain.append(current)
+                current = parent
+            for _ in reversed(chain):
+                paths[_] = paths[parents[_]] + [parents[_]]
 
+        updated = 0
+        requests = [UpdateOne({"_id": _}, {"$set": {"ancestors": path}}) for _, path in paths.items()]
+        for start in range(0, len(requests), batch_size):
+            result = await collection.bulk_write(requests[start:start + batch_size], ordered=False)
+            updated += result.modified_count
+        return updated
+
+    async def get_all_categories(self) -> List[CategoryModel] | None:
+        try:
+            return await self._listing({})
         except Exception as e:
             logging.error(e)
             return None
 
+    async def search_categories(self, query: str, limit: int = 10) -> List[CategoryModel]:
+        """Categories with a word of name starting with query, like CategoryTrie, anchored regex uses name_words index"""
+        key = normalize_name(query)
+        if not key:
+            return []
+        try:
+            cursor = self.document.get_motor_collection().find(
+                {"name_words": {"$regex": "^" + re.escape(key)}}, self.listing_projection
+            ).sort("name_key", ASCENDING).limit(limit)
+            return [self._trusted(_) async for _ in cursor]
+        except Exception as e:
+            logging.error(e)
+            return []
 
-    async def update_name_category(self,doc_id: str, name: str) -> CategoryModel:
+    async def backfill_name_keys(self, batch_size: int = 1000) -> int:
+        """Migration for collections created before name_key and name_words fields, returns count of updated categories"""
+        collection = self.document.get_motor_collection()
+        requests = []
+        async for _ in collection.find({}, {"name": 1}):
+            key = normalize_name(_.get("name", ""))
+            requests.append(UpdateOne({"_id": _["_id"]}, {"$set": {"name_key": key, "name_words": word_starts(key)}}))
+        updated = 0
+        for start in range(0, len(requests), batch_size):
+            result = await collection.bulk_write(requests[start:start + batch_size], ordered=False)
+            updated += result.modified_count
+        return updated
+
+    async def export_categories(self, batch_size: int = 1000) -> AsyncIterator[dict]:
+        cursor = self.document.get_motor_collection().find({}, {"revision_id": 0}, batch_size=batch_size)
+        async for data in cursor:
+            data["id"] = data.pop("_id")
+            yield data
+
+    async def insert_categories(self, categories: List[CategoryModel], batch_size: int = 1000) -> int:
+        collection = self.document.get_motor_collection()
+        inserted = 0
+        for start in range(0, len(categories), batch_size):
+            documents = []
+            for category in categories[start:start + batch_size]:
+                data = _encode(category.dict())
+                data["_id"] = data.pop("id")
+                documents.append(data)
+            try:
+                result = await collection.insert_many(documents, ordered=False)
+                inserted += len(result.inserted_ids)
+            except BulkWriteError as e:
+                logging.error(e.details.get("writeErrors", [])[:10])
+                inserted += e.details.get("nInserted", 0)
+        return inserted
+
+    async def add_category(self, category: CategoryModel) -> CategoryModel | None:
         try:
-            category = await self.document.get(doc_id)
-            new_data = Set(category.name, name)
-            await category.update(new_data)
-            category.name = name
-            return category
+            category.ancestors = await self._ancestors_for(category.parent_id)
+            data = _encode(category.dict())
+            data["_id"] = data.pop("id")
+            await self.document.get_motor_collection().insert_one(data)
+            if category.parent_id != 'root':
+                await self.update_subcategories(category.parent_id, [category.id])
+            return self._trusted(data)
         except Exception as e:
             logging.error(e)
             return None
 
 
-    async def update_desciption_category(self, doc_id: str, description: str) -> CategoryModel:
+    async def _run_transaction(self, callback):
+        """Run callback(session) in a transaction, or without one on servers that do not support it"""
+        client = self.document.get_motor_collection().database.client
+        async with await client.start_session() as session:
+            try:
+                return await session.with_transaction(callback)
+            except OperationFailure as e:
+                # IllegalOperation: standalone server has no transactions
+                if e.code != 20:
+                    raise
+        return await callback(None)
+
+    async def delete_category(self, doc_id: str, saveChilderns: bool = False) ->  None:
         try:
-            category = await self.document.get(doc_id)
-            new_data = Set(category.description, description)
-            await category.update(new_data)
-            category.description = description
-            return category
+            category = await self.get_category(doc_id)
+            if not category:
+                return
+            collection = self.document.get_motor_collection()
+
+            async def delete(session) -> None:
+                if category.parent_id != 'root':
+                    await collection.update_one(
+                        {"_id": category.parent_id}, {"$pull": {"subcategories": doc_id}}, session=session
+                    )
+                    if saveChilderns and category.subcategories:
+                        # children take place of deleted category in parent
+                        await collection.update_one(
+                            {"_id": category.parent_id},
+                            {"$push": {"subcategories": {"$each": category.subcategories}}},
+                            session=session,
+                        )
+
+                if saveChilderns and category.subcategories:
+                    await collection.update_many(
+                        {"parent_id": doc_id}, {"$set": {"parent_id": category.parent_id}}, session=session
+                    )
+                    await collection.update_many(
+                        {"ancestors": doc_id}, {"$pull": {"ancestors": doc_id}}, session=session
+                    )
+                    await collection.delete_one({"_id": doc_id}, session=session)
+                else:
+                    # the whole branch has doc_id in its path
+                    await collection.delete_many({"$or": [{"_id": doc_id}, {"ancestors": doc_id}]}, session=session)
+
+            await self._run_transaction(delete)
+
         except Exception as e:
             logging.error(e)
             return None
 
 
+    async def _find_and_update(self, doc_id: str, update: dict) -> CategoryModel | None:
+        document = await self.document.get_motor_collection().find_one_and_update(
+            {"_id": doc_id}, update, return_document=ReturnDocument.AFTER
+        )
+        if document:
+            return self._trusted(document)
+        return None
 
-    async def update_parent_id(self, doc_id: str, parent_id: str) -> CategoryModel:
+    async def patch_category(self, doc_id: str, **fields) -> CategoryModel | None:
+        """
+        Set several fields of category in one write and return updated category
+
+        parent_id is not accepted here, use update_parent_id which also moves the branch"""
+        unknown = (set(fields) - set(CategoryModel.__fields__)) | (set(fields) & {"id", "parent_id", "ancestors", "name_key", "name_words"})
+        if unknown:
+            raise ValueError(f"{unknown} can't be patched")
+        if "name" in fields:
+            fields["name_key"] = normalize_name(fields["name"])
+            fields["name_words"] = word_starts(fields["name_key"])
         try:
-            category = await self.document.get(doc_id)
-            new_data = Set(category.parent_id, parent_id)
-            await category.update(new_data)
-            category.parent_id = parent_id
-            return category
+            return await self._find_and_update(doc_id, {"$set": _encode(fields)})
         except Exception as e:
             logging.error(e)
             return None
 
+    async def update_name_category(self,doc_id: str, name: str) -> CategoryModel:
+        return await self.patch_category(doc_id, name=name)
 
+    async def update_desciption_category(self, doc_id: str, description: List[ChainModel]) -> CategoryModel:
+        return await self.patch_category(doc_id, description=description)
+
+    async def update_parent_id(self, doc_id: str, parent_id: str) -> CategoryModel:
+        """
+        Move doc_id with its branch under parent_id in one transaction
+
+        Subcategories of old and new parent and paths of the branch are updated too.
+        Raises ValueError for missing parent or cycle, returns None if doc_id is missing
+        """
+        collection = self.document.get_motor_collection()
+
+        async def move(session) -> CategoryModel | None:
+            ancestors = await self._ancestors_for(parent_id, session)
+            if doc_id in ancestors:
+                raise ValueError(f"Category {doc_id} can't be moved under itself or its descendant {parent_id}")
+            document = await collection.find_one_and_update(
+                {"_id": doc_id},
+                {"$set": {"parent_id": parent_id, "ancestors": ancestors}},
+                return_document=ReturnDocument.BEFORE,
+                session=session,
+            )
+            if document is None:
+                return None
+            old_parent_id = document.get("parent_id", "root")
+            if old_parent_id != parent_id:
+                if old_parent_id != 'root':
+                    await collection.update_one({"_id": old_parent_id}, {"$pull": {"subcategories": doc_id}}, session=session)
+                if parent_id != 'root':
+                    await collection.update_one({"_id": parent_id}, {"$addToSet": {"subcategories": doc_id}}, session=session)
+            await self._rebase_descendants(doc_id, document.get("ancestors", []), ancestors, session)
+            document.update(parent_id=parent_id, ancestors=ancestors)
+            return self._trusted(document)
 
-    async def update_subcategories(self, doc_id: str, subcategories: List[str]) -> CategoryModel:
         try:
-            category = await self.document.get(doc_id)
-            category.subcategories.extend(subcategories)
-            new_data = Set(category.subcategories,  category.subcategories)
-            await category.update(new_data)
-            category.subcategories = subcategories
-            return category
+            return await self._run_transaction(move)
+        except ValueError:
+            raise
         except Exception as e:
             logging.error(e)
             return None
 
-    async def update_extra_category(self,doc_id: str, extra: str) -> CategoryModel:
+    async def update_subcategories(self, doc_id: str, subcategories: List[str]) -> CategoryModel:
+        """Append subcategories ids which category doesn't have yet"""
         try:
-            category = await self.document.get(doc_id)
-            new_data = Set(category.extra, extra)
-            await category.update(new_data)
-            category.extra = extra
-            return category
+            return await self._find_and_update(
+                doc_id, {"$addToSet": {"subcategories": {"$each": subcategories}}}
+            )
         except Exception as e:
             logging.error(e)
             return None
+
+    async def update_extra_category(self,doc_id: str, extra: str) -> CategoryModel:
+        return await self.patch_category(doc_id, extra=extra)
+
+
+def _encode(value):
+    if isinstance(value, BaseModel):
+        return value.dict()
+    if isinstance(value, ChainRecord):
+        return value.to_dict()
+    if isinstance(value, dict):
+        return dict((key, _encode(_)) for key, _ in value.items())
+    if isinstance(value, list):
+        return [_encode(_) for _ in value]
+    return value
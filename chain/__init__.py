@@ -1,8 +1,12 @@
-from .messages_chain import MessagesChain, MessageChainStates
-from .chain_model import ChainModel
-
-__all__ = (MessagesChain,MessageChainStates,ChainModel)
-
 from aiogram import __version__ as AIOGRAM_VERSION
 
+# set before submodules are imported, chain_repo reads it
 AIOGRAM_VERSION = int(AIOGRAM_VERSION[0])
+
+from .messages_chain import MessagesChain, MessageChainStates
+from .chain_model import ChainModel, ChainRecord
+from .plan import SendPlan, compile_chain
+from .sender import ChainSender
+from .metrics import PrometheusRecorder, Recorder
+
+__all__ = (MessagesChain,MessageChainStates,ChainModel,ChainRecord,ChainSender,SendPlan,compile_chain,Recorder,PrometheusRecorder)
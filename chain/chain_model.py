@@ -1,4 +1,5 @@
-from typing import List
+from dataclasses import dataclass, fields
+from typing import List, Tuple
 
 
 from pydantic import BaseModel
@@ -10,4 +11,68 @@ class ChainModel(BaseModel):
     is_media_group: bool = False
     content_type: str | List[str]
     text: str | None
+    # where original messages are, used to replay chain with copyMessage
+    source_chat_id: int | None = None
+    source_message_ids: List[int] = []
+    # set on album parts written one by one, parts with same id are merged in storage
+    media_group_id: str | None = None
 
+    class Config:
+        # storages share instances instead of copying them
+        allow_mutation = False
+
+    def merge_album_part(self, part: "ChainModel") -> "ChainModel":
+        """Album entry with part appended, caption is taken from the first part which has it"""
+        return self.copy(update={
+            "content_type": list(self.content_type) + list(part.content_type),
+            "data_id": list(self.data_id) + list(part.data_id),
+            "source_message_ids": self.source_message_ids + part.source_message_ids,
+            "text": self.text or part.text,
+        })
+
+    @classmethod
+    def trusted(cls, data: dict) -> "ChainModel":
+        """Build model from data written by this module without validation"""
+        return cls.construct(**data)
+
+    def to_record(self) -> "ChainRecord":
+        return ChainRecord.from_dict(self.__dict__)
+
+
+@dataclass(frozen=True, slots=True)
+class ChainRecord:
+    """
+    Read-only compact ChainModel, storages return it from reads
+
+    Lists are stored as tuples, convert with to_model() where ChainModel is expected
+    """
+    message_id: int | str | None
+    data_id: Tuple[str, ...] | str | None
+    is_media_group: bool
+    content_type: Tuple[str, ...] | str
+    text: str | None
+    source_chat_id: int | None = None
+    source_message_ids: Tuple[int, ...] = ()
+    media_group_id: str | None = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ChainRecord":
+        values = dict((_.name, data[_.name]) for _ in fields(cls) if _.name in data)
+        for name in ("data_id", "content_type", "source_message_ids"):
+            if isinstance(values.get(name), list):
+                values[name] = tuple(values[name])
+        values.setdefault("message_id", None)
+        values.setdefault("data_id", None)
+        values.setdefault("is_media_group", False)
+        values.setdefault("text", None)
+        return cls(**values)
+
+    def to_dict(self) -> dict:
+        values = dict((_.name, getattr(self, _.name)) for _ in fields(self))
+        for name, value in values.items():
+            if isinstance(value, tuple):
+                values[name] = list(value)
+        return values
+
+    def to_model(self) -> ChainModel:
+        return ChainModel.trusted(self.to_dict())
@@ -1,3 +1,5 @@
+from __future__ import annotations
+
 from aiogram import Dispatcher
 from . import AIOGRAM_VERSION
 from .storage.memory import MemoryStorage
@@ -31,6 +33,7 @@ elif AIOGRAM_VERSION == 2:
 
         from aiogram.contrib.fsm_storage.mongo import MongoStorage as AiogramMongoStorage
 
+        from .mongo_pool import share_aiogram_client
         from .storage.mongo import MongoStorage
     except ModuleNotFoundError:
         # ignore if motor is not installed
@@ -58,24 +61,28 @@ elif AIOGRAM_VERSION == 2:
 
 
 class   ChainRepo:
-    async def __init__(self, dispatcher: Dispatcher, storage_prefix:str| None, ttl: int = 2) -> None:
-        await self._wrap_storage(
-                        dispatcher.get_current().storage, storage_prefix, ttl
-                    )
+    @classmethod
+    async def create(cls, dispatcher: Dispatcher, storage_prefix:str| None, ttl: int = 24 * 60 * 60) -> MemoryStorage | MongoStorage | RedisStorage:
+        """Chain storage on top of dispatcher FSM storage, ready to use when returned"""
+        storage = await cls._wrap_storage(dispatcher.storage, storage_prefix, ttl)
+        await storage.init()
+        return storage
 
 
-    async def _wrap_storage(self, storage: AiogramMemoryStorage|AiogramMongoStorage|AiogramRedisStorage| AiogramRedis2Storage, prefix: str, ttl: int) -> MemoryStorage | MongoStorage | RedisStorage | None:
+    @staticmethod
+    async def _wrap_storage(storage: AiogramMemoryStorage|AiogramMongoStorage|AiogramRedisStorage| AiogramRedis2Storage, prefix: str, ttl: int) -> MemoryStorage | MongoStorage | RedisStorage:
         storage_type = type(storage)
 
         if storage_type is AiogramMemoryStorage:
-            return MemoryStorage(data=[])
+            return MemoryStorage()
 
-        elif MONGO_INSTALLED:
+        if MONGO_INSTALLED:
             if storage_type is AiogramMongoStorage:
+                share_aiogram_client(storage)
                 mongo: motor_asyncio.AsyncIOMotorDatabase = await storage.get_db()
                 return MongoStorage(db=mongo, prefix=prefix, ttl=ttl)
 
-        elif REDIS_INSTALLED:
+        if REDIS_INSTALLED:
             if storage_type is AiogramRedisStorage:
                 connection: aioredis.Connection = await storage.redis()
                 return RedisStorage(connection=connection, prefix=prefix, ttl=ttl)
@@ -84,8 +91,7 @@ class   ChainRepo:
                 redis: aioredis.Redis = await storage.redis()
                 return RedisStorage(connection=redis, prefix=prefix, ttl=ttl)
 
-        else:
-            raise ValueError(f"{storage_type} is unsupported storage")
+        raise ValueError(f"{storage_type} is unsupported storage")
 
     #     class ChainControlModel(Document, ChainModel):
     #         pass
@@ -1,12 +1,18 @@
-from typing import List
+import logging
+from typing import List, Sequence
 from aiogram import Dispatcher
 
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
-from aiogram.types import ContentType, InlineKeyboardMarkup, MediaGroup, Message
+from aiogram.types import ContentType, InlineKeyboardMarkup, Message
+from aiogram.utils.exceptions import TelegramAPIError
 from aiogram_media_group import media_group_handler
-from .chain_model import ChainModel
+from .chain_model import ChainModel, ChainRecord
 from .chain_repo import ChainRepo
+from .metrics import Recorder, count_round_trip
+from .storage.base import BaseStorage
+from .plan import SendPlan, SendStep, compile_chain, is_plan
+from .sender import ChainSender
 
 
 class MessageChainStates(StatesGroup):
@@ -15,44 +21,53 @@ class MessageChainStates(StatesGroup):
 
 
 class MessagesChain:
-    def __init__(self,dispatcher: Dispatcher, prefix: str = "ChainRepo") -> None:
-        self.repo= ChainRepo(dispatcher=dispatcher, storage_prefix=prefix)
+    sender = ChainSender()
+
+    def __init__(self, repo: BaseStorage, recorder: Recorder | None = None) -> None:
+        self.repo= repo
+        # pass it to chain_read to time every send, see metrics.Recorder
+        self.recorder = recorder
+
+    @classmethod
+    async def create(
+        cls, dispatcher: Dispatcher, prefix: str = "ChainRepo", ttl: int = 24 * 60 * 60, recorder: Recorder | None = None,
+    ) -> "MessagesChain":
+        """
+        Usage:
+
+        .. code-block:: python3
+
+            chain = await MessagesChain.create(dp, prefix="my_chain")
+        """
+        return cls(await ChainRepo.create(dispatcher=dispatcher, storage_prefix=prefix, ttl=ttl), recorder)
 
     @property
     def repository(self):
         return self.repo
 
-    async def chain_start_write(self) -> None:
-        await MessageChainStates.write.set()
-        await self.repo.delete_all()
+    async def chain_start_write(self, state: FSMContext, write_state: State = MessageChainStates.write) -> None:
+        await state.set_state(write_state)
+        await self.repo.delete_all(state.chat, state.user)
 
     @media_group_handler(only_album=False)
     async def chain_write(self,message: List[Message]) -> None:
         module = self.repo
+        chat, user = message[0].chat.id, message[0].from_user.id
         text = None
         if len(message) > 1:
             types = list(_.content_type for _ in message)
-            ids = []
-            data_id = None
-            for data in message:
-
-                match data.content_type:
-                    case ContentType.PHOTO:
-                        data_id = data.photo[-1].file_id
-                    case ContentType.VIDEO:
-                        data_id = data.video.file_id
-                    case ContentType.DOCUMENT:
-                        data_id = data.document.file_id
-                    case  ContentType.TEXT:
-                        data_id = None
-
-                ids.append(data_id)
+            ids = [self._data_id(data) for data in message]
             text_list = list(_.html_text for _ in message if _.caption)
             text = None
             if text_list:
                 text = text_list[0]
             await module.add_message(
+                chat,
+                user,
                 ChainModel(
+                    message_id=message[0].message_id,
+                    source_chat_id=chat,
+                    source_message_ids=[_.message_id for _ in message],
                     is_media_group=True,
                     content_type=types,
                     data_id=ids,
@@ -64,133 +79,144 @@ class MessagesChain:
             text = message[0].html_text
 
         msg = message[0]
-        data_id = None
+        await module.add_message(
+            chat,
+            user,
+            ChainModel(
+                message_id=msg.message_id,
+                source_chat_id=chat,
+                source_message_ids=[msg.message_id],
+                content_type=msg.content_type,
+                data_id=self._data_id(msg),
+                text=text,
+            )
+        )
+
+    async def chain_write_message(self, message: Message) -> None:
+        """
+        Streaming alternative to chain_write, register it for the write state instead
+
+        Every message is stored as soon as it comes, album parts are merged
+        by media_group_id in storage, so nothing waits for the album timeout
+        """
+        chat, user = message.chat.id, message.from_user.id
+        text = message.html_text if message.caption or message.text else None
+        if message.media_group_id:
+            description = ChainModel(
+                message_id=message.message_id,
+                source_chat_id=chat,
+                source_message_ids=[message.message_id],
+                is_media_group=True,
+                media_group_id=message.media_group_id,
+                content_type=[message.content_type],
+                data_id=[self._data_id(message)],
+                text=text,
+            )
+        else:
+            description = ChainModel(
+                message_id=message.message_id,
+                source_chat_id=chat,
+                source_message_ids=[message.message_id],
+                content_type=message.content_type,
+                data_id=self._data_id(message),
+                text=text,
+            )
+        await self.repo.add_message(chat, user, description)
+
+    @staticmethod
+    def _data_id(msg: Message) -> str | None:
         match msg.content_type:
             case ContentType.PHOTO:
-                data_id = msg.photo[-1].file_id
+                return msg.photo[-1].file_id
             case ContentType.VIDEO:
-                data_id = msg.video.file_id
+                return msg.video.file_id
             case ContentType.DOCUMENT:
-                data_id = msg.document.file_id
-            case ContentType.TEXT:
-                data_id = None
+                return msg.document.file_id
             case ContentType.STICKER:
-                data_id = msg.sticker.file_id
+                return msg.sticker.file_id
             case ContentType.VIDEO_NOTE:
-                data_id = msg.video_note.file_id
+                return msg.video_note.file_id
             case ContentType.VOICE:
-                data_id = msg.voice.file_id
-
-        await module.add_message(
-            ChainModel(
-                content_type=msg.content_type,
-                data_id=data_id,
-                text=text,
-            )
-        )
+                return msg.voice.file_id
+        return None
 
     async def chain_finish_write(self,state: FSMContext) -> List[ChainModel]:
+        """Close writing and return the chain, with chain_write_message nothing is left to wait for"""
         await state.finish()
-        list_descriptions = await self.repo.get_all_chain()
-        return list_descriptions
+        list_descriptions = await self.repo.get_all_chain(state.chat, state.user)
+        return [_.to_model() if isinstance(_, ChainRecord) else _ for _ in list_descriptions]
 
-    @staticmethod
+    @classmethod
     async def chain_read(
+        cls,
         message: Message,
-        description: List[ChainModel] | None,
+        description: Sequence[ChainModel] | Sequence[ChainRecord] | SendPlan | None,
         markup: InlineKeyboardMarkup | None = None,
+        replay: bool = False,
+        recorder: Recorder | None = None,
     ) -> None:
-        if isinstance(description, list):
-            if not markup:
-                markup = None
-            if len(description) == 1:
-                last_msg = description[0]
-
-            else:
-                last_msg = description.pop()
-                for msg in description:
-                    text = msg.text
-                    data_id = msg.data_id
-                    if isinstance(msg.content_type, list) and isinstance(data_id, list):
-
-                        media = MediaGroup()
-                        medias = [
-                            {"type": type, "media": id}
-                            for type, id in zip(msg.content_type, msg.data_id)
-                        ]
-                        medias[-1] = {
-                            "type": msg.content_type[-1],
-                            "media": msg.data_id[-1],
-                            "caption": msg.text,
-                        }
-                        media.attach_many(*medias)
-                        await message.answer_media_group(media)
-
-                    else:
-                        match msg.content_type:
-                            case ContentType.PHOTO:
-                                await message.answer_photo(photo=data_id, caption=text)
-                            case ContentType.VIDEO:
-                                await message.answer_video(video=data_id, caption=text)
-                            case ContentType.DOCUMENT:
-                                await message.answer_document(
-                                    document=data_id, caption=text
-                                )
-                            case ContentType.TEXT:
-                                if text:
-                                    await message.answer(text=text)
-                            case ContentType.STICKER:
-                                await message.answer_sticker(sticker=data_id)
-                            case ContentType.VIDEO_NOTE:
-                                await message.answer_video_note(video_note=data_id)
-                            case ContentType.VOICE:
-                                await message.answer_voice(voice=data_id)
-
-            if isinstance(last_msg.content_type, list):
-
-                media = MediaGroup()
-                medias = [
-                    {"type": type, "media": id}
-                    for type, id in zip(last_msg.content_type, last_msg.data_id)
-                ]
-                medias[-1] = {
-                    "type": last_msg.content_type[-1],
-                    "media": last_msg.data_id[-1],
-                    "caption": last_msg.text,
-                }
-                media.attach_many(*medias)
-                await message.answer_media_group(media)
-                text = "__"
-                await message.answer(text=text, reply_markup=markup)
-            data_id = last_msg.data_id
-            text = "__"
-            if last_msg.text:
-                text = last_msg.text
-            match last_msg.content_type:
-                case ContentType.PHOTO:
-                    await message.answer_photo(
-                        photo=data_id, caption=text, reply_markup=markup
-                    )
-                case ContentType.VIDEO:
-                    await message.answer_video(
-                        video=data_id, caption=text, reply_markup=markup
-                    )
-                case ContentType.DOCUMENT:
-                    await message.answer_document(
-                        document=data_id, caption=text, reply_markup=markup
-                    )
-                case ContentType.TEXT:
-                    await message.answer(text=text, reply_markup=markup)
-                case ContentType.STICKER:
-                    await message.answer_sticker(sticker=data_id, reply_markup=markup)
-                case ContentType.VIDEO_NOTE:
-                    await message.answer_video_note(
-                        video_note=data_id, reply_markup=markup
+        """
+        Send description to the chat of message
+
+        description can be compiled once with compile_chain and reused,
+        replay - copy original messages when they are known (ignored for compiled plans),
+        recorder - times every send, usually recorder of the chain instance,
+        calls go through cls.sender, concurrent reads to different chats run in parallel
+        """
+        if not is_plan(description):
+            description = compile_chain(description, replay=replay)
+        sender = cls.sender
+        chat_id = message.chat.id
+        async with sender.lock(chat_id):
+            for step in description:
+                if recorder is None:
+                    await cls._send_step(sender, chat_id, message, step, markup)
+                    continue
+                count_round_trip("send")
+                with recorder.span("chain.send", method=step.method):
+                    await cls._send_step(sender, chat_id, message, step, markup)
+
+    @classmethod
+    async def _send_step(
+        cls,
+        sender: ChainSender,
+        chat_id: int,
+        message: Message,
+        step: SendStep,
+        markup: InlineKeyboardMarkup | None,
+    ) -> None:
+        kwargs = step.kwargs
+        if step.markup and markup:
+            kwargs = {**kwargs, "reply_markup": markup}
+        if not step.on_bot:
+            await sender.send(chat_id, getattr(message, step.method), **kwargs)
+            return
+
+        call = getattr(message.bot, step.method, None)
+        if call is not None:
+            try:
+                await sender.send(chat_id, call, chat_id=chat_id, **kwargs)
+                return
+            except TelegramAPIError as e:
+                if not step.groups:
+                    raise
+                logging.warning(f"Can't replay chain messages: {e}")
+        # copy_messages is missing in older aiogram versions, or the batch failed as a whole:
+        # copy single messages one by one, albums are sent again as media groups to keep them whole
+        copy_single = call is None or step.method != "copy_message"
+        for group, fallback in zip(step.groups, step.fallback):
+            if copy_single and len(group) == 1:
+                try:
+                    await sender.send(
+                        chat_id,
+                        message.bot.copy_message,
+                        chat_id=chat_id,
+                        from_chat_id=kwargs["from_chat_id"],
+                        message_id=group[0],
+                        **({"reply_markup": kwargs["reply_markup"]} if "reply_markup" in kwargs else {}),
                     )
-                case ContentType.VOICE:
-                    await message.answer_voice(voice=data_id, reply_markup=markup)
-        else:
-            await message.answer(
-                "Нет описания, задай описание в настройках курса/плана",
-                reply_markup=markup,
-            )
+                    continue
+                except TelegramAPIError as e:
+                    logging.warning(f"Can't copy chain message {group[0]}: {e}")
+            if fallback is not None:
+                await cls._send_step(sender, chat_id, message, fallback, markup)
@@ -1,20 +1,35 @@
 from abc import abstractmethod, ABC
-from typing import List
-from ..chain_model import ChainModel
+from typing import Sequence
+from ..chain_model import ChainModel, ChainRecord
 
 
 class BaseStorage(ABC):
+    """
+    Chain buffers are separated by chat and user,
+    so several admins can write descriptions at the same time
+    """
+
+    async def init(self) -> None:
+        """Create collections and indexes, awaited once before the first request"""
+        pass
 
 
     @abstractmethod
-    async def add_message(self, description: ChainModel) -> None:
+    async def add_message(self, chat: int | str, user: int | str, description: ChainModel) -> None:
+        """
+        Append description to the chain
+
+        If description has media_group_id and the last entry of the chain
+        is the same album, description is merged into it
+        """
         pass
 
     @abstractmethod
-    async def get_all_chain(self) -> List[ChainModel]:
+    async def get_all_chain(self, chat: int | str, user: int | str) -> Sequence[ChainModel | ChainRecord]:
+        """Chain in order of writing, storages which decode it return compact records"""
         pass
 
 
     @abstractmethod
-    async def delete_all(self) -> None:
+    async def delete_all(self, chat: int | str, user: int | str) -> None:
         pass
@@ -1,23 +1,80 @@
-from typing import List, Dict
+import logging
+import time
+from typing import Dict, List, Sequence, Tuple
 
 from aiogram import types
 
-from Modules.messages_chain.chain_model import ChainModel
+from ..chain_model import ChainModel
 
 from .base import BaseStorage
 
 
 class MemoryStorage(BaseStorage):
-    def __init__(self, data: List):
-        self._data = data
+    """
+    Chains are kept as lists of the given models without copying, so add_message is O(1).
+    get_all_chain returns a tuple snapshot, which is rebuilt only after a write,
+    ChainModel is immutable
 
-    async def add_message(self, description: ChainModel) -> None:
+    max_messages - messages kept per session, the rest is dropped
+    idle_ttl - seconds after the last write when abandoned session is removed, None to keep forever
+    """
 
-        self._data.append(description.dict())
+    def __init__(
+        self,
+        data: Dict[Tuple[str, str], Sequence[ChainModel]] | None = None,
+        max_messages: int = 1000,
+        idle_ttl: float | None = 60 * 60,
+    ):
+        self._data: Dict[Tuple[str, str], List[ChainModel]] = dict((key, list(chain)) for key, chain in (data or {}).items())
+        self._snapshots: Dict[Tuple[str, str], Tuple[ChainModel, ...]] = {}
+        self._touched: Dict[Tuple[str, str], float] = dict((_, time.monotonic()) for _ in self._data)
+        self.max_messages = max_messages
+        self.idle_ttl = idle_ttl
+        self._evicted_at = time.monotonic()
 
-    async def get_all_chain(self) -> List[ChainModel]:
-        return [ChainModel.parse_obj(_) for _ in self._data]
+    @staticmethod
+    def _key(chat: int | str, user: int | str) -> Tuple[str, str]:
+        return str(chat), str(user)
 
+    def _evict_idle(self, now: float) -> None:
+        # full scan at most once per idle_ttl / 10
+        if self.idle_ttl is None or now - self._evicted_at < self.idle_ttl / 10:
+            return
+        self._evicted_at = now
+        for key in [_ for _, touched in self._touched.items() if now - touched > self.idle_ttl]:
+            self._data.pop(key, None)
+            self._snapshots.pop(key, None)
+            del self._touched[key]
 
-    async def delete_all(self) -> None:
-        self._data.clear()
+    async def add_message(self, chat: int | str, user: int | str, description: ChainModel) -> None:
+        now = time.monotonic()
+        self._evict_idle(now)
+        key = self._key(chat, user)
+        chain = self._data.setdefault(key, [])
+        self._touched[key] = now
+        if description.media_group_id and chain and chain[-1].media_group_id == description.media_group_id:
+            chain[-1] = chain[-1].merge_album_part(description)
+            self._snapshots.pop(key, None)
+            return
+        if len(chain) >= self.max_messages:
+            logging.warning(f"Chain of {key} has {self.max_messages} messages, message dropped")
+            return
+        chain.append(description)
+        self._snapshots.pop(key, None)
+
+    async def get_all_chain(self, chat: int | str, user: int | str) -> Sequence[ChainModel]:
+        key = self._key(chat, user)
+        snapshot = self._snapshots.get(key)
+        if snapshot is None:
+            chain = self._data.get(key)
+            if not chain:
+                return ()
+            snapshot = self._snapshots[key] = tuple(chain)
+        return snapshot
+
+
+    async def delete_all(self, chat: int | str, user: int | str) -> None:
+        key = self._key(chat, user)
+        self._data.pop(key, None)
+        self._snapshots.pop(key, None)
+        self._touched.pop(key, None)
@@ -1,13 +1,14 @@
 import asyncio
 import datetime
 import logging
+import time
 from typing import List
 from typing import Literal
 from typing import TYPE_CHECKING
 
 from aiogram import types
 
-from Modules.messages_chain.chain_model import ChainModel
+from ..chain_model import ChainModel, ChainRecord
 
 from .base import BaseStorage
 
@@ -19,40 +20,45 @@ try:
 except ImportError:
     pass
 
-try:
-    import ujson as json
-except ImportError:
-    import json
-
 Documents = Literal["MessageChain"]
 
 
 class MongoStorage(BaseStorage):
     def __init__(self, db: "motor_asyncio.AsyncIOMotorDatabase", prefix: str, ttl: int):
         self._ttl = ttl
-        self._collection: motor_asyncio.AsyncIOMotorCollection = db[prefix]
+        self._seq = 0
+        self._collection: "motor_asyncio.AsyncIOMotorCollection" = db[prefix]
+        self._db = db
+        self._prefix = prefix
 
-        loop = asyncio.get_event_loop()
-
-        #  This happens when MongoDB driver is used as storage_driver argument
-        if loop.is_closed():
-            loop = asyncio.new_event_loop()
-            loop.run_until_complete(self._create_collection(db, prefix, ttl))
-            loop.close()
-        else:
-            loop.create_task(self._create_collection(db, prefix, ttl))
+    async def init(self) -> None:
+        await self._create_collection(self._db, self._prefix, self._ttl)
 
     async def _create_collection(self, db: "motor_asyncio.AsyncIOMotorDatabase", prefix: str, ttl: int):
         try:
             if prefix not in await db.list_collection_names():
                 await db.create_collection(prefix)
 
-            if "expireAt" not in await self._list_index_names(db, prefix):
-                await db[prefix].create_index("expireAt", expireAfterSeconds=ttl)
+            index_names = await self._list_index_names(db, prefix)
+            requests = []
+            if "expireAt" not in index_names:
+                requests.append(db[prefix].create_index("expireAt", expireAfterSeconds=ttl))
 
             elif ttl != self._ttl:
                 self._ttl = ttl
-                await db.command("collMod", prefix, index={ "keyPattern": { "expireAt": 1 }, "expireAfterSeconds": ttl })
+                requests.append(db.command("collMod", prefix, index={ "keyPattern": { "expireAt": 1 }, "expireAfterSeconds": ttl }))
+
+            if "session" not in index_names:
+                requests.append(db[prefix].create_index([("session", 1), ("seq", 1)]))
+
+            # one entry per album in session, parts are merged into it
+            requests.append(db[prefix].create_index(
+                [("session", 1), ("media_group_id", 1)],
+                name="session_album",
+                unique=True,
+                partialFilterExpression={"media_group_id": {"$type": "string"}},
+            ))
+            await asyncio.gather(*requests)
 
         except OperationFailure:
             pass
@@ -61,8 +67,7 @@ class MongoStorage(BaseStorage):
         names = []
 
         async for index in db[prefix].list_indexes():
-            index = json.loads(json.dumps(index, default=lambda item: getattr(item, "__dict__", str(item))))
-            name = list(index["key"].keys())[0]
+            name = next(iter(index["key"]))
 
             if name == "expireAt":
                 self._ttl = index["expireAfterSeconds"]
@@ -71,18 +76,60 @@ class MongoStorage(BaseStorage):
 
         return names
 
-    async def add_message(self, description: ChainModel) -> None:
+    @staticmethod
+    def _session(chat: int | str, user: int | str) -> str:
+        return f"{chat}:{user}"
+
+    def _next_seq(self) -> int:
+        # strictly increasing even when clock returns the same value twice
+        self._seq = max(time.time_ns(), self._seq + 1)
+        return self._seq
+
+    async def add_message(self, chat: int | str, user: int | str, description: ChainModel) -> None:
         try:
-            await self._collection.insert_one(description.dict())
+            if description.media_group_id:
+                return await self._add_album_part(chat, user, description)
+            await self._collection.insert_one({
+                "session": self._session(chat, user),
+                "seq": self._next_seq(),
+                "expireAt": datetime.datetime.utcnow(),
+                **description.dict(),
+            })
         except Exception as e:
             logging.error(e)
 
-    async def get_all_chain(self) -> List[ChainModel]:
+    async def _add_album_part(self, chat: int | str, user: int | str, description: ChainModel) -> None:
+        data = description.dict()
+        push = {
+            "content_type": {"$each": data.pop("content_type")},
+            "data_id": {"$each": data.pop("data_id")},
+            "source_message_ids": {"$each": data.pop("source_message_ids")},
+        }
+        update = {
+            "$push": push,
+            "$setOnInsert": {"seq": self._next_seq(), **data},
+            "$set": {"expireAt": datetime.datetime.utcnow()},
+        }
+        query = {"session": self._session(chat, user), "media_group_id": description.media_group_id}
+        try:
+            await self._collection.update_one(query, update, upsert=True)
+        except DuplicateKeyError:
+            # other part of the album created the entry meanwhile
+            await self._collection.update_one(query, update)
+        if data["text"]:
+            # caption of the first part which has it is kept, like in merge_album_part
+            await self._collection.update_one({**query, "text": None}, {"$set": {"text": data["text"]}})
+
+    async def get_all_chain(self, chat: int | str, user: int | str) -> List[ChainRecord]:
         try:
-            return await self._collection.find_one({})
+            cursor = self._collection.find(
+                {"session": self._session(chat, user)},
+                projection={"_id": False, "session": False, "seq": False, "expireAt": False},
+            ).sort("seq", 1)
+            return [ChainRecord.from_dict(_) for _ in await cursor.to_list(length=None)]
         except Exception as e:
             logging.error(e)
 
 
-    async def delete_all(self) -> None:
-        await self._collection.delete_many({})
+    async def delete_all(self, chat: int | str, user: int | str) -> None:
+        await self._collection.delete_many({"session": self._session(chat, user)})
@@ -1,13 +1,18 @@
 from typing import List
 from typing import TYPE_CHECKING
-import datetime
 from aiogram import types
-from..chain_model import ChainModel
+from..chain_model import ChainModel, ChainRecord
 from .base import BaseStorage
 
 if TYPE_CHECKING:
     import aioredis
 
+try:
+    from aioredis.exceptions import WatchError
+except ImportError:
+    # redis.asyncio client has the same interface
+    from redis.exceptions import WatchError
+
 try:
     import ujson as json
 except ImportError:
@@ -15,37 +20,60 @@ except ImportError:
 
 
 class RedisStorage(BaseStorage):
-    async def __init__(self, connection: "aioredis.Redis", prefix: str, ttl: int):
+    def __init__(self, connection: "aioredis.Redis", prefix: str, ttl: int):
         self._connection = connection
         self._prefix = prefix
         self._ttl = ttl
 
-    async def add_message(self, description: ChainModel) -> bool:
+    def _key(self, chat: int | str, user: int | str) -> str:
+        return f"{self._prefix}:chain:{chat}:{user}"
+
+    async def add_message(self, chat: int | str, user: int | str, description: ChainModel) -> bool:
         try:
-            await self._connection.set(
-            name= datetime.datetime.strftime(datetime.datetime.now()),
-            value=description.json()
-            )
+            key = self._key(chat, user)
+            if description.media_group_id:
+                return await self._add_album_part(key, description)
+            async with self._connection.pipeline(transaction=True) as pipe:
+                pipe.rpush(key, description.json())
+                if self._ttl:
+                    pipe.expire(key, self._ttl)
+                await pipe.execute()
             return True
         except Exception as e:
             return False
 
+    async def _add_album_part(self, key: str, description: ChainModel) -> bool:
+        async with self._connection.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    last = await pipe.lindex(key, -1)
+                    last = ChainModel.trusted(json.loads(last)) if last else None
+                    pipe.multi()
+                    if last and last.media_group_id == description.media_group_id:
+                        pipe.lset(key, -1, last.merge_album_part(description).json())
+                    else:
+                        pipe.rpush(key, description.json())
+                    if self._ttl:
+                        pipe.expire(key, self._ttl)
+                    await pipe.execute()
+                    return True
+                except WatchError:
+                    # other part of the album was written meanwhile
+                    continue
 
-    async def get_all_chain(self) -> List[ChainModel]| List:
-        try:
 
-            keys = await self._connection.keys()
-            chain = [ChainModel.parse_obj(await self._connection.get(key)) for key in keys]
-            return chain
+    async def get_all_chain(self, chat: int | str, user: int | str) -> List[ChainRecord]:
+        try:
+            chain = await self._connection.lrange(self._key(chat, user), 0, -1)
+            return [ChainRecord.from_dict(json.loads(_)) for _ in chain]
         except Exception as e:
             return []
 
 
-    async def delete_all(self) -> bool:
+    async def delete_all(self, chat: int | str, user: int | str) -> bool:
         try:
-
-            keys = await self._connection.keys()
-            chain = [await self._connection.delete(key) for key in keys]
+            await self._connection.delete(self._key(chat, user))
             return True
         except Exception as e:
             return False
@@ -0,0 +1,157 @@
+import asyncio
+import functools
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Tuple
+
+# round trips of the handler running in current task, None outside of traced handlers
+_round_trips: ContextVar[Counter | None] = ContextVar("round_trips", default=None)
+
+
+def count_round_trip(kind: str) -> None:
+    """Count storage call or Bot API send for the handler running now"""
+    trips = _round_trips.get()
+    if trips is not None:
+        trips[kind] += 1
+
+
+class Recorder:
+    """
+    Receives timings of storages, handlers and sends
+
+    Nothing is traced unless recorder is passed, so disabled metrics cost nothing.
+    Override record and observe to send values somewhere, or span to use own tracer.
+
+    Usage:
+
+    .. code-block:: python3
+
+        recorder = PrometheusRecorder()
+        category = await Category.create(MongoConnection(db_name='bot'), dp, recorder=recorder)
+        ...
+        text = recorder.render()  # serve it on /metrics
+    """
+
+    def record(self, name: str, seconds: float, labels: Dict[str, Any]) -> None:
+        pass
+
+    def observe(self, name: str, value: float, labels: Dict[str, Any]) -> None:
+        pass
+
+    @contextmanager
+    def span(self, name: str, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started, labels)
+
+    def handler(self, name: str, func: Callable) -> Callable:
+        """
+        Wrap aiogram handler, round trips made while it runs are observed
+        as name.round_trips with kind label (storage, send)
+        """
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            token = _round_trips.set(Counter())
+            try:
+                with self.span(name):
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        for kind in ("storage", "send"):
+                            self.observe(f"{name}.round_trips", _round_trips.get()[kind], {"kind": kind})
+            finally:
+                _round_trips.reset(token)
+        return wrapper
+
+
+class Traced:
+    """
+    Proxy which times every coroutine method of target as prefix.method
+
+    Calls are counted as storage round trips of the running handler
+    (calls answered by CachedStorage from memory are counted too)
+    """
+
+    def __init__(self, target: Any, recorder: Recorder, prefix: str) -> None:
+        self._target = target
+        self._recorder = recorder
+        self._prefix = prefix
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._target, name)
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+        recorder = self._recorder
+        span_name = f"{self._prefix}.{name}"
+
+        @functools.wraps(attr)
+        async def wrapper(*args, **kwargs):
+            count_round_trip("storage")
+            with recorder.span(span_name):
+                return await attr(*args, **kwargs)
+
+        self.__dict__[name] = wrapper
+        return wrapper
+
+
+class PrometheusRecorder(Recorder):
+    """Keeps count and sum of every span and value, render() returns Prometheus text format"""
+
+    def __init__(self, namespace: str = "") -> None:
+        self.namespace = namespace
+        self._summaries: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], list] = {}
+
+    def _add(self, metric: str, value: float, labels: Dict[str, Any]) -> None:
+        key = (metric, tuple(sorted((str(k), str(v)) for k, v in labels.items())))
+        summary = self._summaries.get(key)
+        if summary is None:
+            summary = self._summaries[key] = [0, 0.0]
+        summary[0] += 1
+        summary[1] += value
+
+    def _metric(self, name: str) -> str:
+        name = re.sub(r"[^a-zA-Z0-9_]", "_", name)
+        return f"{self.namespace}_{name}" if self.namespace else name
+
+    def record(self, name: str, seconds: float, labels: Dict[str, Any]) -> None:
+        self._add(self._metric(name) + "_seconds", seconds, labels)
+
+    def observe(self, name: str, value: float, labels: Dict[str, Any]) -> None:
+        self._add(self._metric(name), value, labels)
+
+    def render(self) -> str:
+        lines = []
+        typed = set()
+        for (metric, labels), (count, total) in sorted(self._summaries.items()):
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} summary")
+            text = ",".join(f'{k}="{v}"' for k, v in labels)
+            text = "{" + text + "}" if text else ""
+            lines.append(f"{metric}_count{text} {count}")
+            lines.append(f"{metric}_sum{text} {total}")
+        return "\n".join(lines) + "\n"
+
+
+class OpenTelemetryRecorder(Recorder):
+    """Spans go to OpenTelemetry tracer, needs opentelemetry-api"""
+
+    def __init__(self, tracer=None) -> None:
+        from opentelemetry import trace
+
+        self._trace = trace
+        self.tracer = tracer or trace.get_tracer("messages_chain")
+
+    @contextmanager
+    def span(self, name: str, **labels) -> Iterator[None]:
+        with self.tracer.start_as_current_span(name, attributes=dict((k, str(v)) for k, v in labels.items())):
+            yield
+
+    def observe(self, name: str, value: float, labels: Dict[str, Any]) -> None:
+        key = ".".join([name] + [str(_) for _ in labels.values()])
+        self._trace.get_current_span().set_attribute(key, value)
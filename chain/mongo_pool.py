@@ -0,0 +1,54 @@
+from typing import Dict, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+
+_clients: Dict[Tuple[str, str], AsyncIOMotorClient] = {}
+
+
+def get_client(uri: str = "mongodb://localhost:27017", **options) -> AsyncIOMotorClient:
+    """
+    Process-wide Motor client for uri and options
+
+    Clients with equal uri and options are created once and shared, so every module
+    uses the same connection pools. Pool size is set with pymongo options,
+    e.g. maxPoolSize, minPoolSize, maxIdleTimeMS.
+
+    Usage:
+
+    .. code-block:: python3
+
+        client = get_client("mongodb://localhost:27017", maxPoolSize=20)
+        ...
+        close_clients()  # on shutdown
+    """
+    key = (uri, repr(sorted(options.items())))
+    client = _clients.get(key)
+    if client is None:
+        client = _clients[key] = AsyncIOMotorClient(uri, **options)
+    return client
+
+
+def close_clients() -> None:
+    """Close every shared client, call it once on shutdown"""
+    for client in _clients.values():
+        client.close()
+    _clients.clear()
+
+
+def share_aiogram_client(storage) -> AsyncIOMotorClient:
+    """
+    Make aiogram MongoStorage use the shared client for its settings
+
+    aiogram keeps client in storage._mongo and reuses it when it is set
+    """
+    if storage._uri:
+        uri = storage._uri
+    else:
+        uri = 'mongodb://'
+        if storage._username and storage._password:
+            uri += f'{storage._username}:{storage._password}@'
+        uri += f'{storage._host}:{storage._port}' if storage._host else f'localhost:{storage._port}'
+    client = get_client(uri, **storage._kwargs)
+    storage._mongo = client
+    return client
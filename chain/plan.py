@@ -0,0 +1,163 @@
+from types import MappingProxyType
+from typing import Any, List, Mapping, NamedTuple, Sequence, Tuple
+
+from aiogram.types import ContentType, MediaGroup
+
+from .chain_model import ChainModel, ChainRecord
+
+
+NO_DESCRIPTION = "Нет описания, задай описание в настройках курса/плана"
+
+
+class SendStep(NamedTuple):
+    """
+    One Bot API call
+
+    method is name of Message method, or of Bot method when on_bot is set
+    (chat_id is added at send time)
+
+    Copy steps have groups - message ids of every copied chain message, and
+    fallback - send step for every group (None if message can't be sent again),
+    used for the groups which weren't copied
+    """
+    method: str
+    kwargs: Mapping
+    markup: bool = False
+    on_bot: bool = False
+    fallback: Tuple["SendStep | None", ...] = ()
+    groups: Tuple[Tuple[int, ...], ...] = ()
+
+
+SendPlan = Tuple[SendStep, ...]
+
+# content type: (Message method, file argument, has caption)
+_METHODS = {
+    ContentType.PHOTO: ("answer_photo", "photo", True),
+    ContentType.VIDEO: ("answer_video", "video", True),
+    ContentType.DOCUMENT: ("answer_document", "document", True),
+    ContentType.STICKER: ("answer_sticker", "sticker", False),
+    ContentType.VIDEO_NOTE: ("answer_video_note", "video_note", False),
+    ContentType.VOICE: ("answer_voice", "voice", False),
+}
+
+
+# copyMessages accepts up to 100 ids
+COPY_BATCH_SIZE = 100
+
+
+def is_plan(description: Any) -> bool:
+    """True for result of compile_chain, chains can be tuples too"""
+    return isinstance(description, tuple) and bool(description) and isinstance(description[0], SendStep)
+
+
+def _step(method: str, markup: bool = False, **kwargs) -> SendStep:
+    return SendStep(method, MappingProxyType(kwargs), markup)
+
+
+def _copy(from_chat_id: int, groups: List[Sequence[int]], fallback: List[SendStep | None], markup: bool = False) -> SendStep:
+    groups = tuple(tuple(_) for _ in groups)
+    message_ids = [_ for group in groups for _ in group]
+    if len(message_ids) == 1:
+        kwargs = {"from_chat_id": from_chat_id, "message_id": message_ids[0]}
+        return SendStep("copy_message", MappingProxyType(kwargs), markup, True, tuple(fallback), groups)
+    kwargs = {"from_chat_id": from_chat_id, "message_ids": message_ids}
+    return SendStep("copy_messages", MappingProxyType(kwargs), markup, True, tuple(fallback), groups)
+
+
+def _media_group(msg: ChainModel) -> SendStep:
+    media = MediaGroup()
+    medias = [
+        {"type": type, "media": id}
+        for type, id in zip(msg.content_type, msg.data_id)
+    ]
+    medias[-1] = {
+        "type": msg.content_type[-1],
+        "media": msg.data_id[-1],
+        "caption": msg.text,
+    }
+    media.attach_many(*medias)
+    return _step("answer_media_group", media=media)
+
+
+def _single(msg: ChainModel, text: str | None, markup: bool) -> SendStep | None:
+    if msg.content_type == ContentType.TEXT:
+        if not text:
+            return None
+        return _step("answer", markup, text=text)
+    if msg.content_type not in _METHODS:
+        return None
+    method, argument, has_caption = _METHODS[msg.content_type]
+    if has_caption:
+        return _step(method, markup, **{argument: msg.data_id, "caption": text})
+    return _step(method, markup, **{argument: msg.data_id})
+
+
+def _per_type(msg: ChainModel) -> SendStep | None:
+    if isinstance(msg.content_type, (list, tuple)) and isinstance(msg.data_id, (list, tuple)):
+        return _media_group(msg)
+    return _single(msg, msg.text, markup=False)
+
+
+def _can_copy(msg: ChainModel) -> bool:
+    return msg.source_chat_id is not None and bool(msg.source_message_ids)
+
+
+def _replay(description: Sequence[ChainModel]) -> List[SendStep | None]:
+    """Copy steps for every message except the last, neighbours from one chat are batched"""
+    steps = []
+    batch: List[ChainModel] = []
+
+    def flush() -> None:
+        if batch:
+            groups = [msg.source_message_ids for msg in batch]
+            steps.append(_copy(batch[0].source_chat_id, groups, [_per_type(msg) for msg in batch]))
+            batch.clear()
+
+    for msg in description:
+        if not _can_copy(msg):
+            flush()
+            steps.append(_per_type(msg))
+            continue
+        size = sum(len(_.source_message_ids) for _ in batch)
+        if batch and (
+            batch[0].source_chat_id != msg.source_chat_id
+            or size + len(msg.source_message_ids) > COPY_BATCH_SIZE
+        ):
+            flush()
+        batch.append(msg)
+    flush()
+    return steps
+
+
+def compile_chain(description: Sequence[ChainModel] | Sequence[ChainRecord] | None, replay: bool = False) -> SendPlan:
+    """
+    Turn description (models or compact records) into ready Bot API calls
+
+    Markup goes to the step marked with markup=True
+
+    replay - copy original messages where they are known instead of sending them by file_id,
+    every copy step falls back to the usual send if copying fails
+    """
+    if not description:
+        return (_step("answer", True, text=NO_DESCRIPTION),)
+
+    if replay:
+        steps = _replay(description[:-1])
+    else:
+        steps = [_per_type(msg) for msg in description[:-1]]
+
+    last_msg = description[-1]
+    if isinstance(last_msg.content_type, (list, tuple)):
+        # media group can't have markup, so it goes with separate message
+        if replay and _can_copy(last_msg):
+            steps.append(_copy(last_msg.source_chat_id, [last_msg.source_message_ids], [_media_group(last_msg)]))
+        else:
+            steps.append(_media_group(last_msg))
+        steps.append(_step("answer", True, text="__"))
+    else:
+        single = _single(last_msg, last_msg.text or "__", markup=True)
+        if replay and _can_copy(last_msg):
+            single = _copy(last_msg.source_chat_id, [last_msg.source_message_ids], [single], markup=True)
+        steps.append(single)
+
+    return tuple(_ for _ in steps if _ is not None)
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, TypeVar
+
+from aiogram.utils.exceptions import RetryAfter
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """rate tokens per second, up to capacity tokens can be spent at once"""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def is_full(self) -> bool:
+        self._refill()
+        return self._tokens >= self.capacity
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        """Spend future tokens, used when Telegram asks to wait"""
+        self._refill()
+        self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+
+class _Chat:
+    def __init__(self, rate: float, burst: float) -> None:
+        self.lock = asyncio.Lock()
+        self.bucket = TokenBucket(rate, burst)
+
+
+class ChainSender:
+    """
+    Sends Bot API calls within Telegram flood limits
+
+    Every chat has its own token bucket and lock, so calls for one chat keep
+    their order, while calls for different chats run concurrently and share
+    only the global bucket. RetryAfter pauses the chat and the call is repeated.
+
+    Usage:
+
+    .. code-block:: python3
+
+        sender = ChainSender()
+        async with sender.lock(chat_id):
+            await sender.send(chat_id, bot.send_message, chat_id, "text")
+    """
+
+    def __init__(
+        self,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3,
+        global_rate: float = 30.0,
+        max_retries: int = 5,
+        max_idle_chats: int = 10000,
+    ) -> None:
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_idle_chats = max_idle_chats
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[int | str, _Chat] = {}
+
+    def _chat(self, chat_id: int | str) -> _Chat:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            if len(self._chats) >= self.max_idle_chats:
+                self._prune()
+            chat = self._chats[chat_id] = _Chat(self.chat_rate, self.chat_burst)
+        return chat
+
+    def _prune(self) -> None:
+        for chat_id in [_ for _, chat in self._chats.items() if not chat.lock.locked() and chat.bucket.is_full]:
+            del self._chats[chat_id]
+
+    def lock(self, chat_id: int | str) -> asyncio.Lock:
+        """Hold it to send several calls to chat without other calls in between"""
+        return self._chat(chat_id).lock
+
+    async def send(self, chat_id: int | str, call: Callable[..., Awaitable[T]], /, *args, **kwargs) -> T:
+        bucket = self._chat(chat_id).bucket
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire()
+            await self._global.acquire()
+            try:
+                return await call(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                logging.warning(f"Flood control in chat {chat_id}, retry in {e.timeout} seconds")
+                bucket.pause(e.timeout)
@@ -0,0 +1,34 @@
+"""
+Makes modules importable under their package names without installing them
+
+chain/ (with chain/messages_chain/storage) is messages_chain, category/category is category.
+Imported by benchmarks and tests, so both run from a checkout:
+
+    python -m benchmarks.storage
+    python -m pytest tests
+"""
+import importlib.machinery
+import importlib.util
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+
+
+def _package(name: str, locations, init: Path | None = None) -> None:
+    if name in sys.modules:
+        return
+    locations = [str(_) for _ in locations]
+    if init is None:
+        spec = importlib.machinery.ModuleSpec(name, None, is_package=True)
+        spec.submodule_search_locations = locations
+    else:
+        spec = importlib.util.spec_from_file_location(name, init, submodule_search_locations=locations)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    if init is not None:
+        spec.loader.exec_module(module)
+
+
+_package("messages_chain", [ROOT / "chain", ROOT / "chain" / "messages_chain"], ROOT / "chain" / "__init__.py")
+_package("category", [ROOT / "category" / "category"])
@@ -0,0 +1,7 @@
+"""Tests import modules under their package names, see local_packages"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import local_packages  # noqa: E402,F401
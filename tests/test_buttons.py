@@ -0,0 +1,35 @@
+from category.buttons import CategoryButtons, CategoryCallBackData
+from category.model import CategoryModel
+
+
+def _keyboard(buttons, current_id):
+    categories = [CategoryModel(id=f"{current_id}{_}", name=str(_), parent_id=current_id) for _ in range(3)]
+    return buttons._categories(categories, None, current_id)
+
+
+def test_keyboards_are_cached_until_invalidated():
+    buttons = CategoryButtons(CategoryCallBackData(), cache_size=16)
+    first = _keyboard(buttons, "a")
+    _keyboard(buttons, "b")
+    assert buttons.cached_markup("a") is first
+    buttons.invalidate("a")
+    assert buttons.cached_markup("a") is None
+    assert buttons.cached_markup("b") is not None
+    buttons.clear()
+    assert buttons.cached_markup("b") is None
+
+
+def test_cached_keyboards_expire(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("category.cache.time.monotonic", lambda: now[0])
+    buttons = CategoryButtons(CategoryCallBackData(), cache_size=16, ttl=10)
+    _keyboard(buttons, "a")
+    assert buttons.cached_markup("a") is not None
+    now[0] += 11
+    assert buttons.cached_markup("a") is None
+
+
+def test_keyboards_are_not_cached_without_size():
+    buttons = CategoryButtons(CategoryCallBackData())
+    _keyboard(buttons, "a")
+    assert buttons.cached_markup("a") is None
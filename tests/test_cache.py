@@ -0,0 +1,36 @@
+from category.cache import LRUCache
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_expired_entries_are_dropped(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("category.cache.time.monotonic", lambda: now[0])
+    cache = LRUCache(ttl=10)
+    cache.set("a", 1)
+    now[0] += 5
+    assert cache.get("a") == 1
+    now[0] += 6
+    assert cache.get("a", "missing") == "missing"
+    assert len(cache) == 0
+
+
+def test_pop_where_and_falsy_values():
+    cache = LRUCache()
+    cache.set("a", 0)
+    cache.set("b", [])
+    cache.set("c", 3)
+    assert "a" in cache
+    assert cache.pop("b", "missing") == []
+    cache.pop_where(lambda key, value: value == 3)
+    assert dict(cache.items()) == {"a": 0}
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from category.model import CategoryModel
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from category.storage.cached import CachedStorage  # noqa: E402
+from category.storage.mongo import MongoStorage  # noqa: E402
+
+# a -> b -> c, a -> d, e
+TREE = [("a", "root"), ("b", "a"), ("c", "b"), ("d", "a"), ("e", "root")]
+
+
+async def _cached() -> CachedStorage:
+    storage = MongoStorage(mongomock_motor.AsyncMongoMockClient()["test"])
+    await storage.init()
+
+    async def run_transaction(callback):
+        # mongomock has no sessions
+        return await callback(None)
+
+    storage._run_transaction = run_transaction
+    for doc_id, parent_id in TREE:
+        await storage.add_category(CategoryModel(id=doc_id, name=doc_id, parent_id=parent_id))
+    return CachedStorage(storage)
+
+
+def test_writes_drop_category_its_parent_and_branch():
+    async def main():
+        repo = await _cached()
+        first = await repo.get_category("b")
+        assert first is await repo.get_category("b")
+        await repo.get_category("c")
+        await repo.get_category("a")
+        await repo.add_category(CategoryModel(id="f", name="f", parent_id="a"))
+        await repo.update_parent_id("b", "e")
+        return [await repo.get_category(_) for _ in "abc"]
+
+    parent, moved, child = asyncio.run(main())
+    assert "f" in parent.subcategories
+    assert (moved.parent_id, list(moved.ancestors)) == ("e", ["e"])
+    assert list(child.ancestors) == ["e", "b"]
+
+
+def test_writes_drop_category_and_listings_of_parent():
+    async def main():
+        repo = await _cached()
+        assert [_.name for _ in await repo.get_subcategories("a")] == ["b", "d"]
+        first = await repo.get_category("b")
+        assert first is await repo.get_category("b")
+        await repo.update_name_category("b", "renamed")
+        return await repo.get_category("b"), await repo.get_subcategories("a")
+
+    category, listing = asyncio.run(main())
+    assert category.name == "renamed"
+    assert [_.name for _ in listing] == ["renamed", "d"]
+
+
+def test_writes_drop_pages_of_parent():
+    async def main():
+        repo = await _cached()
+        page, total = await repo.get_subcategories_page("a", 1, 1)
+        assert ([_.id for _ in page], total) == (["b"], 2)
+        await repo.add_category(CategoryModel(id="f", name="f", parent_id="a"))
+        await repo.delete_category("b")
+        return await repo.get_subcategories_page("a", 1, 1), await repo.get_category("c")
+
+    (page, total), deleted_child = asyncio.run(main())
+    assert ([_.id for _ in page], total) == (["d"], 2)
+    assert deleted_child is None
+
+
+def test_move_drops_both_parents():
+    async def main():
+        repo = await _cached()
+        await repo.get_subcategories("a")
+        await repo.get_subcategories("e")
+        await repo.get_category("c")
+        await repo.update_parent_id("b", "e")
+        return await repo.get_subcategories("a"), await repo.get_subcategories("e"), await repo.get_category("c")
+
+    old_parent, new_parent, child = asyncio.run(main())
+    assert [_.id for _ in old_parent] == ["d"]
+    assert [_.id for _ in new_parent] == ["b"]
+    assert list(child.ancestors) == ["e", "b"]
+
+
+def test_listeners_get_changed_ids():
+    async def main():
+        repo = await _cached()
+        changes = []
+        repo.subscribe(changes.append)
+        await repo.get_category("b")
+        await repo.update_name_category("b", "renamed")
+        repo.clear()
+        return changes
+
+    changes = asyncio.run(main())
+    assert changes[0] >= {"a", "b"}
+    assert changes[-1] is None
@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+from category.model import CategoryModel
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from category.storage.mongo import MongoStorage  # noqa: E402
+
+# a -> b -> c -> d, a -> e, b -> f, g
+TREE = [("a", "root"), ("b", "a"), ("c", "b"), ("d", "c"), ("e", "a"), ("f", "b"), ("g", "root")]
+
+
+async def _storage(tree=TREE) -> MongoStorage:
+    storage = MongoStorage(mongomock_motor.AsyncMongoMockClient()["test"])
+    await storage.init()
+
+    async def run_transaction(callback):
+        # mongomock has no sessions
+        return await callback(None)
+
+    storage._run_transaction = run_transaction
+    for doc_id, parent_id in tree:
+        await storage.add_category(CategoryModel(id=doc_id, name=doc_id, parent_id=parent_id))
+    return storage
+
+
+async def _paths(storage: MongoStorage) -> dict:
+    categories = await storage.get_all_categories()
+    return dict((_.id, (_.parent_id, list(_.ancestors))) for _ in categories)
+
+
+def test_branch_is_breadth_first():
+    async def main():
+        storage = await _storage()
+        return [
+            [_.id for _ in await storage.get_branch_categories(doc_id, max_depth)]
+            for doc_id, max_depth in (("a", None), ("a", 1), ("a", 2), ("b", None), ("a", 0))
+        ]
+
+    assert asyncio.run(main()) == [["b", "e", "c", "f", "d"], ["b", "e"], ["b", "e", "c", "f"], ["c", "f", "d"], []]
+
+
+def test_move_rebases_descendants():
+    async def main():
+        storage = await _storage()
+        moved = await storage.update_parent_id("b", "g")
+        with pytest.raises(ValueError):
+            await storage.update_parent_id("g", "c")
+        return moved, await _paths(storage)
+
+    moved, paths = asyncio.run(main())
+    assert (moved.parent_id, list(moved.ancestors)) == ("g", ["g"])
+    assert paths["c"] == ("b", ["g", "b"])
+    assert paths["d"] == ("c", ["g", "b", "c"])
+    assert paths["f"] == ("b", ["g", "b"])
+    assert paths["e"] == ("a", ["a"])
+
+
+def test_move_updates_both_parents():
+    async def main():
+        storage = await _storage()
+        await storage.update_parent_id("b", "g")
+        await storage.update_parent_id("e", "root")
+        return dict([(_, (await storage.get_category(_)).subcategories) for _ in "abeg"])
+
+    assert asyncio.run(main()) == {"a": [], "b": ["c", "f"], "e": [], "g": ["b"]}
+
+
+def test_delete_removes_branch():
+    async def main():
+        storage = await _storage()
+        await storage.delete_category("b")
+        return await _paths(storage), (await storage.get_category("a")).subcategories
+
+    paths, subcategories = asyncio.run(main())
+    assert sorted(paths) == ["a", "e", "g"]
+    assert subcategories == ["e"]
+
+
+def test_delete_keeps_children():
+    async def main():
+        storage = await _storage()
+        await storage.delete_category("b", saveChilderns=True)
+        return await _paths(storage), (await storage.get_category("a")).subcategories
+
+    paths, subcategories = asyncio.run(main())
+    assert "b" not in paths
+    assert paths["c"] == ("a", ["a"])
+    assert paths["d"] == ("c", ["a", "c"])
+    assert subcategories == ["e", "c", "f"]
+
+
+def test_pages_keep_order_and_total():
+    async def main():
+        tree = [("p", "root")] + [(f"c{_}", "p") for _ in (3, 1, 2, 0, 4)]
+        tree += [(f"r{_}", "root") for _ in (2, 0, 1)]
+        storage = await _storage(tree)
+        pages = [await storage.get_subcategories_page("p", page, 2) for page in (1, 2, 3, 4)]
+        root_pages = [await storage.get_subcategories_page("root", page, 3) for page in (1, 2)]
+        return pages, root_pages, await storage.get_subcategories("root")
+
+    pages, root_pages, root = asyncio.run(main())
+    assert [([_.id for _ in page], total) for page, total in pages] == [
+        (["c3", "c1"], 5), (["c2", "c0"], 5), (["c4"], 5), ([], 5),
+    ]
+    # main categories are sorted by name
+    assert [([_.id for _ in page], total) for page, total in root_pages] == [(["p", "r0", "r1"], 4), (["r2"], 4)]
+    assert [_.id for _ in root] == ["p", "r0", "r1", "r2"]
+
+
+def test_search_matches_word_starts():
+    async def main():
+        storage = await _storage([])
+        for doc_id, name in (("1", "Red Shoes"), ("2", "Shoe rack"), ("3", "Blue"), ("4", "re.d")):
+            await storage.add_category(CategoryModel(id=doc_id, name=name))
+        return [[_.id for _ in await storage.search_categories(query)] for query in ("sho", "RE", "rack", "re.", "x")]
+
+    # sorted by normalized name
+    assert asyncio.run(main()) == [["1", "2"], ["4", "1"], ["2"], ["4"], []]
+
+
+def test_listing_reads_skip_description():
+    async def main():
+        storage = await _storage([])
+        await storage.add_category(CategoryModel(id="a", name="a", extra="extra"))
+        (whole,), _ = await storage.get_categories(["a"])
+        (listed,), missing = await storage.get_categories(["a", "z"], listing=True)
+        return whole, listed, missing
+
+    whole, listed, missing = asyncio.run(main())
+    assert whole.extra == "extra"
+    assert listed.extra is None and listed.name == "a"
+    assert missing == ["z"]
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from messages_chain.chain_model import ChainModel, ChainRecord
+
+
+def _part(index, group="g", text=None):
+    return ChainModel(
+        message_id=index, is_media_group=True, media_group_id=group, content_type=["photo"],
+        data_id=[f"file_{index}"], text=text, source_chat_id=1, source_message_ids=[index],
+    )
+
+
+def _text(index):
+    return ChainModel(message_id=index, content_type="text", data_id=None, text=str(index))
+
+
+def _redis_storage():
+    fakeredis = pytest.importorskip("fakeredis")
+    from messages_chain.storage.redis import RedisStorage
+    return RedisStorage(connection=fakeredis.FakeAsyncRedis(), prefix="test", ttl=60)
+
+
+def _mongo_storage():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from messages_chain.storage.mongo import MongoStorage
+    return MongoStorage(db=mongomock_motor.AsyncMongoMockClient()["test"], prefix="chain", ttl=60)
+
+
+@pytest.mark.parametrize("storage", [_redis_storage, _mongo_storage], ids=["redis", "mongo"])
+def test_album_parts_are_merged(storage):
+    async def main():
+        repo = storage()
+        await repo.init()
+        parts = (_text(0), _part(1, text="first"), _part(2, text="second"), _part(3, group="other"), _text(4))
+        for description in parts:
+            await repo.add_message(1, 2, description)
+        await repo.add_message(1, 3, _text(5))
+        return await repo.get_all_chain(1, 2)
+
+    chain = asyncio.run(main())
+    assert [_.message_id for _ in chain] == [0, 1, 3, 4]
+    assert list(chain[1].data_id) == ["file_1", "file_2"]
+    assert list(chain[1].content_type) == ["photo", "photo"]
+    assert list(chain[1].source_message_ids) == [1, 2]
+    # caption of the first part is kept
+    assert chain[1].text == "first"
+
+
+@pytest.mark.parametrize("storage", [_redis_storage, _mongo_storage], ids=["redis", "mongo"])
+def test_reads_return_records(storage):
+    async def main():
+        repo = storage()
+        await repo.init()
+        for description in (_text(0), _part(1)):
+            await repo.add_message(1, 2, description)
+        return await repo.get_all_chain(1, 2)
+
+    chain = asyncio.run(main())
+    assert all(isinstance(_, ChainRecord) for _ in chain)
+    assert chain[1].data_id == ("file_1",)
+    assert chain[1].to_model() == _part(1)
+    assert chain[0].to_model() == _text(0)
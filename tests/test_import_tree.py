@@ -0,0 +1,68 @@
+import asyncio
+import io
+import json
+
+import pytest
+
+from category.model import CategoryModel
+from category.repo import CategoryRepo
+
+
+class _Repo:
+    """Just the storage calls import_tree makes"""
+
+    def __init__(self, *categories):
+        self.categories = dict((_.id, _) for _ in categories)
+        self.lookups = []
+
+    async def get_categories(self, ids, listing=False):
+        self.lookups.append(list(ids))
+        found = [self.categories[_] for _ in ids if _ in self.categories]
+        return found, [_ for _ in ids if _ not in self.categories]
+
+    async def insert_categories(self, categories, batch_size=1000):
+        for category in categories:
+            self.categories[category.id] = category
+        return len(categories)
+
+    async def update_subcategories(self, doc_id, subcategories):
+        category = self.categories[doc_id]
+        category.subcategories += [_ for _ in subcategories if _ not in category.subcategories]
+        return category
+
+
+def _file(*categories):
+    return io.StringIO("".join(json.dumps(_) + "\n" for _ in categories))
+
+
+def _import(repo, fp):
+    return asyncio.run(CategoryRepo.import_tree(repo, fp))
+
+
+def test_computes_paths_and_subcategories():
+    repo = _Repo(CategoryModel(id="shop", name="Shop"))
+    fp = _file(
+        {"id": "b", "name": "B", "parent_id": "a", "subcategories": []},
+        {"id": "a", "name": "A", "parent_id": "shop", "subcategories": ["c", "b", "gone"]},
+        {"id": "c", "name": "C", "parent_id": "a"},
+    )
+    assert _import(repo, fp) == 3
+    assert repo.categories["b"].ancestors == ["shop", "a"]
+    assert repo.categories["a"].subcategories == ["c", "b"]
+    assert repo.categories["shop"].subcategories == ["a"]
+    # ids of the file and outside parents are checked with one call
+    assert repo.lookups == [["shop", "b", "a", "c"]]
+
+
+@pytest.mark.parametrize("lines, message", [
+    ([{"id": "a", "name": "A"}, {"id": "a", "name": "A"}], "duplicate category a"),
+    ([{"name": "A"}], "category without id"),
+    ([{"id": "a", "name": "A", "parent_id": "b"}, {"id": "b", "name": "B", "parent_id": "a"}], "cycle"),
+    ([{"id": "a", "name": "A", "parent_id": "nowhere"}], "Parents not found: nowhere"),
+    ([{"id": "shop", "name": "Shop"}], "Categories already exist: shop"),
+])
+def test_rejects_invalid_file_before_writing(lines, message):
+    repo = _Repo(CategoryModel(id="shop", name="Shop"))
+    with pytest.raises(ValueError, match=message):
+        _import(repo, _file(*lines))
+    assert list(repo.categories) == ["shop"]
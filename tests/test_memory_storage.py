@@ -0,0 +1,62 @@
+import asyncio
+
+from messages_chain.chain_model import ChainModel
+from messages_chain.storage.memory import MemoryStorage
+
+
+def _part(index, group="g", text=None):
+    return ChainModel(
+        message_id=index, is_media_group=True, media_group_id=group, content_type=["photo"],
+        data_id=[f"file_{index}"], text=text, source_chat_id=1, source_message_ids=[index],
+    )
+
+
+def _text(index):
+    return ChainModel(message_id=index, content_type="text", data_id=None, text=str(index))
+
+
+def test_album_parts_are_merged():
+    async def main():
+        storage = MemoryStorage()
+        for description in (_text(0), _part(1), _part(2, text="caption"), _part(3, group="other"), _text(4)):
+            await storage.add_message(1, 2, description)
+        return await storage.get_all_chain(1, 2)
+
+    chain = asyncio.run(main())
+    assert [_.message_id for _ in chain] == [0, 1, 3, 4]
+    assert chain[1].data_id == ["file_1", "file_2"]
+    assert chain[1].source_message_ids == [1, 2]
+    assert chain[1].text == "caption"
+
+
+def test_messages_over_cap_are_dropped():
+    async def main():
+        storage = MemoryStorage(max_messages=2)
+        for index in range(4):
+            await storage.add_message(1, 2, _text(index))
+        # album part still merges into the last entry when the cap is reached
+        for description in (_text(0), _part(1), _part(2)):
+            await storage.add_message(1, 3, description)
+        return await storage.get_all_chain(1, 2), await storage.get_all_chain(1, 3)
+
+    chain, album_chain = asyncio.run(main())
+    assert [_.message_id for _ in chain] == [0, 1]
+    assert [_.message_id for _ in album_chain] == [0, 1]
+    assert album_chain[1].source_message_ids == [1, 2]
+
+
+def test_snapshot_is_rebuilt_after_write():
+    async def main():
+        storage = MemoryStorage()
+        await storage.add_message(1, 2, _text(0))
+        first = await storage.get_all_chain(1, 2)
+        assert first is await storage.get_all_chain(1, 2)
+        await storage.add_message(1, 2, _text(1))
+        second = await storage.get_all_chain(1, 2)
+        await storage.delete_all(1, 2)
+        return first, second, await storage.get_all_chain(1, 2)
+
+    first, second, deleted = asyncio.run(main())
+    assert [_.message_id for _ in first] == [0]
+    assert [_.message_id for _ in second] == [0, 1]
+    assert deleted == ()
@@ -0,0 +1,67 @@
+from aiogram.types import ContentType
+
+from messages_chain.chain_model import ChainModel
+from messages_chain.plan import COPY_BATCH_SIZE, NO_DESCRIPTION, compile_chain, is_plan
+
+
+def _photo(index, chat=1):
+    return ChainModel(
+        message_id=index, content_type=ContentType.PHOTO, data_id=f"file_{index}", text=f"caption {index}",
+        source_chat_id=chat, source_message_ids=[index],
+    )
+
+
+def _album(index, chat=1):
+    return ChainModel(
+        message_id=index, is_media_group=True, content_type=[ContentType.PHOTO] * 2,
+        data_id=[f"file_{index}", f"file_{index + 1}"], text="album",
+        source_chat_id=chat, source_message_ids=[index, index + 1],
+    )
+
+
+def test_empty_description():
+    plan = compile_chain(None)
+    assert is_plan(plan)
+    assert [(_.method, dict(_.kwargs), _.markup) for _ in plan] == [("answer", {"text": NO_DESCRIPTION}, True)]
+
+
+def test_sends_by_file_id_with_markup_on_last():
+    plan = compile_chain([_photo(1), _album(2), _photo(4)])
+    assert [_.method for _ in plan] == ["answer_photo", "answer_media_group", "answer_photo"]
+    assert [_.markup for _ in plan] == [False, False, True]
+    assert plan[0].kwargs == {"photo": "file_1", "caption": "caption 1"}
+
+
+def test_album_last_gets_separate_markup_message():
+    plan = compile_chain([_album(1)])
+    assert [(_.method, _.markup) for _ in plan] == [("answer_media_group", False), ("answer", True)]
+
+
+def test_replay_batches_messages_of_one_chat():
+    plan = compile_chain([_photo(1), _album(2), _photo(4, chat=2), _photo(5)], replay=True)
+    assert [_.method for _ in plan] == ["copy_messages", "copy_message", "copy_message"]
+    batch = plan[0]
+    assert batch.on_bot
+    assert batch.kwargs == {"from_chat_id": 1, "message_ids": [1, 2, 3]}
+    # one group and fallback per chain message, album is kept whole
+    assert batch.groups == ((1,), (2, 3))
+    assert [_.method for _ in batch.fallback] == ["answer_photo", "answer_media_group"]
+    assert plan[1].kwargs == {"from_chat_id": 2, "message_id": 4}
+    assert plan[-1].markup and plan[-1].fallback[0].method == "answer_photo"
+
+
+def test_replay_splits_batches_and_skips_unknown_sources():
+    description = [_photo(_) for _ in range(COPY_BATCH_SIZE + 2)]
+    description.insert(1, ChainModel(message_id=-1, content_type=ContentType.TEXT, data_id=None, text="typed"))
+    plan = compile_chain(description + [_photo(1000)], replay=True)
+    assert [_.method for _ in plan] == ["copy_message", "answer", "copy_messages", "copy_message", "copy_message"]
+    assert len(plan[2].kwargs["message_ids"]) == COPY_BATCH_SIZE
+
+
+def test_records_compile_like_models():
+    description = [_photo(1), _album(2), _photo(4, chat=2)]
+    records = [_.to_record() for _ in description]
+    for replay in (False, True):
+        models_plan, records_plan = compile_chain(description, replay), compile_chain(records, replay)
+        assert [(_.method, _.markup, _.groups) for _ in records_plan] == [(_.method, _.markup, _.groups) for _ in models_plan]
+        assert [_.kwargs.keys() for _ in records_plan] == [_.kwargs.keys() for _ in models_plan]
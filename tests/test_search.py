@@ -0,0 +1,36 @@
+from category.model import CategoryModel
+from category.search import CategoryTrie
+
+
+def _trie():
+    return CategoryTrie.build([
+        CategoryModel(id="1", name="Running  Shoes"),
+        CategoryModel(id="2", name="Shorts"),
+        CategoryModel(id="3", name="Ashore"),
+        CategoryModel(id="4", name="Shoe care kit"),
+    ])
+
+
+def test_matches_word_starts_only():
+    trie = _trie()
+    assert set(trie.search("sho")) == {"1", "2", "4"}
+    assert trie.search("ore") == []
+    assert trie.search("RUNNING sh") == ["1"]
+
+
+def test_shorter_matches_first_and_limit():
+    trie = _trie()
+    # "shoes" of "Running Shoes" is shorter than "shoe care kit"
+    assert trie.search("shoe") == ["1", "4"]
+    assert trie.search("s", limit=2) == ["1", "2"]
+
+
+def test_add_renames_and_remove():
+    trie = _trie()
+    trie.add("2", "Boots")
+    assert trie.search("shor") == []
+    assert trie.search("boo") == ["2"]
+    trie.remove("2")
+    trie.remove("missing")
+    assert trie.search("boo") == []
+    assert len(trie) == 3
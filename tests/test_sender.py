@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+from aiogram.utils.exceptions import RetryAfter, TelegramAPIError
+
+from messages_chain import ChainModel, MessagesChain
+from messages_chain.sender import ChainSender
+
+
+def _sender(**kwargs):
+    return ChainSender(chat_rate=1000, chat_burst=1000, global_rate=1000, **kwargs)
+
+
+def test_retries_after_flood_control():
+    calls = []
+
+    async def call(chat_id, text):
+        calls.append((chat_id, text))
+        if len(calls) < 3:
+            raise RetryAfter(0)
+        return "sent"
+
+    assert asyncio.run(_sender().send(1, call, chat_id=1, text="hi")) == "sent"
+    assert calls == [(1, "hi")] * 3
+
+
+def test_gives_up_after_max_retries():
+    async def call():
+        raise RetryAfter(0)
+
+    with pytest.raises(RetryAfter):
+        asyncio.run(_sender(max_retries=1).send(1, call))
+
+
+def test_lock_keeps_order_of_chat():
+    sender = _sender()
+    sent = []
+
+    async def call(chat_id, text):
+        await asyncio.sleep(0)
+        sent.append((chat_id, text))
+
+    async def read(chat_id, texts):
+        async with sender.lock(chat_id):
+            for text in texts:
+                await sender.send(chat_id, call, chat_id, text)
+
+    async def main():
+        await asyncio.gather(read(1, "abc"), read(2, "xy"), read(1, "de"))
+
+    asyncio.run(main())
+    assert [text for chat_id, text in sent if chat_id == 1] == list("abcde")
+    assert [text for chat_id, text in sent if chat_id == 2] == list("xy")
+
+
+class _Bot:
+    def __init__(self, sent, broken):
+        self.sent = sent
+        self.broken = broken
+
+    async def copy_message(self, chat_id, from_chat_id, message_id, **kwargs):
+        if message_id in self.broken:
+            raise TelegramAPIError("message to copy not found")
+        self.sent.append(("copy", message_id))
+
+
+class _Message:
+    def __init__(self, broken=()):
+        self.sent = []
+        self.bot = _Bot(self.sent, broken)
+        self.chat = type("Chat", (), {"id": 5})()
+
+    def __getattr__(self, method):
+        async def answer(**kwargs):
+            self.sent.append((method, kwargs.get("text") or kwargs.get("photo")))
+        return answer
+
+
+def _photo(index):
+    return ChainModel(
+        message_id=index, content_type="photo", data_id=f"file_{index}", text=None,
+        source_chat_id=1, source_message_ids=[index],
+    )
+
+
+def test_replay_falls_back_only_for_failed_messages(monkeypatch):
+    monkeypatch.setattr(MessagesChain, "sender", _sender())
+    album = ChainModel(
+        message_id=10, is_media_group=True, content_type=["photo", "photo"], data_id=["a", "b"], text="album",
+        source_chat_id=1, source_message_ids=[10, 11],
+    )
+    message = _Message(broken={2})
+    asyncio.run(MessagesChain.chain_read(message, [_photo(1), _photo(2), album, _photo(3)], replay=True))
+    # no copy_messages in aiogram 2: singles are copied one by one, album is sent whole again
+    assert message.sent == [
+        ("copy", 1), ("answer_photo", "file_2"), ("answer_media_group", None), ("copy", 3),
+    ]